@@ -0,0 +1,221 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Benchmark proxy scan and valid proxy queries on a scratch database,
+# comparing the single column indexes used up to schema v4 with the
+# composite `PROXY_INDEXES` on the same rows.
+#
+# WARNING: tables on the target database are dropped and re-created.
+#
+# usage:
+#
+# python benchmarks/db_queries.py --db-name bench --db-user user \
+#     --db-pass pass --rows 1000000 10000000 --output results.txt
+#
+# python benchmarks/db_queries.py --sqlite /tmp/bench.db --batch 2000 \
+#     --rows 1000000 10000000 --output results.txt
+#
+
+import argparse
+import logging
+import os
+import random
+import sys
+
+from datetime import datetime, timedelta
+from timeit import default_timer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from peewee import SqliteDatabase  # noqa: E402
+
+from proxytools import models  # noqa: E402
+from proxytools.models import Proxy, ProxyProtocol, ProxyStatus  # noqa: E402
+
+log = logging.getLogger()
+
+# Single column indexes replaced by `PROXY_INDEXES` in schema v5.
+LEGACY_INDEXES = tuple(
+    ('proxy_' + field, (field,))
+    for field in ('protocol', 'insert_date', 'scan_date', 'latency',
+                  'fail_count', 'anonymous', 'niantic', 'ptc_login',
+                  'ptc_signup'))
+
+INDEX_SETS = (
+    ('legacy', LEGACY_INDEXES),
+    ('composite', models.PROXY_INDEXES))
+
+
+def get_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sqlite',
+                        help='Benchmark on this SQLite database file '
+                        'instead of MySQL.')
+    parser.add_argument('--db-name')
+    parser.add_argument('--db-user')
+    parser.add_argument('--db-pass')
+    parser.add_argument('--db-host', default='127.0.0.1')
+    parser.add_argument('--db-port', type=int, default=3306)
+    parser.add_argument('--rows', type=int, nargs='+',
+                        default=[1000000, 10000000])
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--batch', type=int, default=10000)
+    parser.add_argument('--output',
+                        help='Also write results to this file.')
+    args = parser.parse_args()
+
+    if not args.sqlite and not (args.db_name and args.db_user and
+                                args.db_pass):
+        parser.error('--db-name, --db-user and --db-pass are required '
+                     'unless --sqlite is used.')
+
+    return args
+
+
+def is_sqlite():
+    return isinstance(models.db.obj, SqliteDatabase)
+
+
+def drop_indexes():
+    names = set(name for _, indexes in INDEX_SETS for name, _ in indexes)
+    for index in models.db.get_indexes('proxy'):
+        if index.name in names:
+            if is_sqlite():
+                models.db.execute_sql('DROP INDEX `{}`;'.format(index.name))
+            else:
+                models.db.execute_sql('DROP INDEX `{}` ON `proxy`;'.format(
+                    index.name))
+
+
+def create_indexes(indexes):
+    timer = default_timer()
+    for index_name, index_fields in indexes:
+        models.db.execute_sql('CREATE INDEX `{}` ON `proxy` ({});'.format(
+            index_name, ', '.join('`{}`'.format(f) for f in index_fields)))
+
+    if is_sqlite():
+        models.db.execute_sql('ANALYZE `proxy`;')
+    else:
+        models.db.execute_sql('ANALYZE TABLE `proxy`;')
+
+    log.info('Created %d indexes in %.1fs.', len(indexes),
+             default_timer() - timer)
+
+
+def random_proxy(idx, now):
+    scanned = random.random() < 0.8
+    status = (ProxyStatus.OK if random.random() < 0.05
+              else random.choice((ProxyStatus.ERROR, ProxyStatus.TIMEOUT)))
+    return {
+        'hash': idx,
+        'ip': idx,
+        'port': random.randint(1, 65535),
+        'protocol': random.choice((ProxyProtocol.HTTP, ProxyProtocol.SOCKS5)),
+        'username': None,
+        'password': None,
+        'insert_date': now - timedelta(seconds=random.randint(0, 86400 * 30)),
+        'scan_date': (now - timedelta(seconds=random.randint(0, 86400))
+                      if scanned else None),
+        'latency': random.randint(50, 5000) if scanned else None,
+        'fail_count': 0 if status == ProxyStatus.OK else random.randint(0, 5),
+        'anonymous': status,
+        'niantic': status,
+        'ptc_login': status,
+        'ptc_signup': status}
+
+
+def populate(start, end, batch_size):
+    now = datetime.utcnow()
+    timer = default_timer()
+    for idx in range(start, end, batch_size):
+        batch = [random_proxy(i, now)
+                 for i in range(idx, min(idx + batch_size, end))]
+        with models.db.atomic():
+            Proxy.insert_many(batch).execute()
+
+    log.info('Inserted %d rows in %.1fs.', end - start, default_timer() - timer)
+
+
+def explain(query):
+    sql, params = query.sql()
+    if is_sqlite():
+        cursor = models.db.execute_sql('EXPLAIN QUERY PLAN ' + sql, params)
+        for row in cursor.fetchall():
+            log.info('  EXPLAIN: %s', row[-1])
+        return
+
+    cursor = models.db.execute_sql('EXPLAIN ' + sql, params)
+    columns = [c[0] for c in cursor.description]
+    for row in cursor.fetchall():
+        row = dict(zip(columns, row))
+        log.info('  EXPLAIN: type=%s key=%s rows=%s extra=%s',
+                 row.get('type'), row.get('key'), row.get('rows'),
+                 row.get('Extra'))
+
+
+def benchmark(name, function, repeat):
+    timings = []
+    for i in range(repeat):
+        timer = default_timer()
+        function()
+        timings.append(default_timer() - timer)
+
+    timings.sort()
+    log.info('%s: best %.1fms, median %.1fms.', name,
+             timings[0] * 1000, timings[len(timings) // 2] * 1000)
+
+
+def run(rows, index_set, repeat):
+    log.info('Benchmarking queries on %d rows with %s indexes.',
+             rows, index_set)
+    for protocol in (None, ProxyProtocol.SOCKS5):
+        benchmark('get_scan(protocol={})'.format(protocol),
+                  lambda: Proxy.get_scan(100, protocol=protocol), repeat)
+        explain(Proxy.select()
+                .where(Proxy.scan_conditions(3600, protocol))
+                .order_by(Proxy.scan_date.asc(), Proxy.insert_date.asc())
+                .limit(100))
+
+    for anonymous in (False, True):
+        benchmark('get_valid(anonymous={})'.format(anonymous),
+                  lambda: Proxy.get_valid(100, anonymous, 3600), repeat)
+
+    conditions = ((Proxy.scan_date > datetime.utcnow() - timedelta(hours=1)) &
+                  (Proxy.fail_count == 0) &
+                  (Proxy.niantic == ProxyStatus.OK) &
+                  (Proxy.ptc_login == ProxyStatus.OK) &
+                  (Proxy.ptc_signup == ProxyStatus.OK))
+    explain(Proxy.select().where(conditions)
+            .order_by(Proxy.latency.asc()).limit(100))
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    args = get_args()
+
+    if args.output:
+        log.addHandler(logging.FileHandler(args.output))
+
+    if args.sqlite:
+        models.db.initialize(SqliteDatabase(args.sqlite))
+        models.db.drop_tables(models.MODELS, safe=True)
+        models.db.create_tables(models.MODELS, safe=True)
+    else:
+        models.init_database(args.db_name, args.db_host, args.db_port,
+                             args.db_user, args.db_pass)
+        models.drop_tables()
+        models.create_tables()
+    models.Version.insert(key='schema_version',
+                          val=models.db_schema_version).execute()
+
+    total = 0
+    for rows in sorted(args.rows):
+        # Rows are inserted without indexes, each index set is then
+        # built and benchmarked on the same data.
+        drop_indexes()
+        populate(total, rows, args.batch)
+        total = rows
+        for index_set, indexes in INDEX_SETS:
+            create_indexes(indexes)
+            run(rows, index_set, args.repeat)
+            drop_indexes()
@@ -0,0 +1,110 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Benchmark scrapper webpage parsing over saved webpage fixtures.
+#
+# Fixtures are HTML files named after the scrapper that parses them, e.g.
+# webpages saved by scrappers in verbose mode: <scrapper name>.html
+# Each fixture is parsed with a full html.parser tree (baseline) and with
+# ProxyScrapper.make_soup (fastest parser available and strainers).
+#
+# usage:
+#
+# python benchmarks/html_parsing.py --fixtures downloads/
+#
+
+import argparse
+import logging
+import os
+import sys
+import tempfile
+
+from argparse import Namespace
+from timeit import default_timer
+
+from bs4 import BeautifulSoup
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from proxytools import proxy_scrapper  # noqa: E402
+from proxytools.scrappers.freeproxylist import Freeproxylist  # noqa: E402
+from proxytools.scrappers.proxynova import ProxyNova  # noqa: E402
+from proxytools.scrappers.proxyserverlist24 import (  # noqa: E402
+    Proxyserverlist24)
+from proxytools.scrappers.sockslist import Sockslist  # noqa: E402
+from proxytools.scrappers.socksproxy import Socksproxy  # noqa: E402
+from proxytools.scrappers.socksproxylist24 import (  # noqa: E402
+    Socksproxylist24)
+from proxytools.scrappers.spysone import SpysHTTPS, SpysSOCKS  # noqa: E402
+
+log = logging.getLogger()
+
+# Scrappers whose parse_webpage() works offline on raw HTML.
+SCRAPPERS = (Freeproxylist, ProxyNova, Proxyserverlist24, Sockslist,
+             Socksproxy, Socksproxylist24, SpysHTTPS, SpysSOCKS)
+
+
+def get_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--fixtures', required=True,
+                        help='Directory with saved webpages.')
+    parser.add_argument('--repeat', type=int, default=10)
+    return parser.parse_args()
+
+
+def scrapper_args():
+    return Namespace(
+        scrapper_timeout=5, scrapper_host_delay=0, scrapper_proxy=None,
+        scrapper_retries=0, scrapper_backoff_factor=0,
+        proxy_ignore_country=[], proxy_refresh_interval=3600, verbose=False,
+        download_path=tempfile.mkdtemp())
+
+
+def full_soup(html, *args, **kwargs):
+    return BeautifulSoup(html, 'html.parser')
+
+
+def benchmark(scrapper, html, repeat):
+    timings = []
+    for i in range(repeat):
+        timer = default_timer()
+        proxylist = scrapper.parse_webpage(html)
+        timings.append(default_timer() - timer)
+
+    timings.sort()
+    return timings[len(timings) // 2], len(proxylist)
+
+
+def run(fixtures, repeat):
+    args = scrapper_args()
+    scrappers = {}
+    for scrapper_class in SCRAPPERS:
+        scrapper = scrapper_class(args)
+        scrappers[scrapper.name] = scrapper
+
+    for filename in sorted(os.listdir(fixtures)):
+        name, ext = os.path.splitext(filename)
+        if ext != '.html' or name not in scrappers:
+            continue
+
+        scrapper = scrappers[name]
+        with open(os.path.join(fixtures, filename), encoding='utf-8') as fd:
+            html = fd.read()
+
+        scrapper.make_soup = full_soup
+        baseline, count = benchmark(scrapper, html, repeat)
+        del scrapper.make_soup
+        fast, fast_count = benchmark(scrapper, html, repeat)
+
+        log.info('%s: html.parser %.1fms, %s + strainer %.1fms '
+                 '(%.1fx), %d/%d proxies.', name, baseline * 1000,
+                 proxy_scrapper.HTML_PARSER, fast * 1000, baseline / fast,
+                 count, fast_count)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    # Silence scrapper logging while benchmarking.
+    logging.getLogger('proxytools').setLevel(logging.CRITICAL)
+    args = get_args()
+    run(args.fixtures, args.repeat)
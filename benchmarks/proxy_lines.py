@@ -0,0 +1,86 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Benchmark proxy line parsing throughput on synthetic proxylists.
+#
+# usage:
+#
+# python benchmarks/proxy_lines.py --lines 1000000 --dirty 0.0 0.5
+#
+
+import argparse
+import logging
+import os
+import random
+import sys
+
+from timeit import default_timer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from proxytools.models import ProxyProtocol  # noqa: E402
+from proxytools.proxy_parser import ProxyLineParser  # noqa: E402
+
+log = logging.getLogger()
+
+DIRTY_LINES = (
+    'not a proxy',
+    '300.1.2.3:8080',
+    '1.2.3.4:70000',
+    'ftp://1.2.3.4:21',
+    '1.2.3.4',
+    '<td>1.2.3.4</td>')
+
+
+def get_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--lines', type=int, default=1000000)
+    parser.add_argument('--dirty', type=float, nargs='+', default=[0.0, 0.5],
+                        help='Ratio of invalid lines in each proxylist.')
+    parser.add_argument('--repeat', type=int, default=5)
+    return parser.parse_args()
+
+
+def random_line():
+    line = '{}.{}.{}.{}:{}'.format(
+        random.randint(1, 255), random.randint(0, 255),
+        random.randint(0, 255), random.randint(0, 255),
+        random.randint(1, 65535))
+
+    roll = random.random()
+    if roll < 0.1:
+        line = 'user{}:pass@{}'.format(random.randint(0, 99), line)
+    elif roll < 0.3:
+        line = random.choice(('http', 'socks4', 'socks5')) + '://' + line
+
+    return line
+
+
+def generate(count, dirty):
+    return [random.choice(DIRTY_LINES) if random.random() < dirty
+            else random_line() for i in range(count)]
+
+
+def benchmark(lines, repeat):
+    timings = []
+    for i in range(repeat):
+        parser = ProxyLineParser(ProxyProtocol.SOCKS5)
+        timer = default_timer()
+        parsed = parser.parse_many(lines, 'benchmark')
+        timings.append(default_timer() - timer)
+
+    timings.sort()
+    log.info('Parsed %d of %d lines: best %.0f lines/s, median %.0f lines/s.',
+             len(parsed), len(lines), len(lines) / timings[0],
+             len(lines) / timings[len(timings) // 2])
+    log.info('Rejected: %s', parser.rejects)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    args = get_args()
+
+    for dirty in args.dirty:
+        log.info('Benchmarking %d lines with %.0f%% invalid lines.',
+                 args.lines, dirty * 100)
+        benchmark(generate(args.lines, dirty), args.repeat)
@@ -6,8 +6,16 @@
 # Builds a dictionary with the decoding information.
 # decoder_dict = {'<var>': <value>, ...}.
 #
+# Variables are evaluated iteratively in dependency order and each one is
+# only computed once, decoding dictionaries are cached by script content.
+#
+
+from functools import lru_cache
 
 
+# Returned dictionary is shared between calls with the same code,
+# callers must not modify it.
+@lru_cache(maxsize=64)
 def parse_crazyxor(code):
     dictionary = {}
     variables = code.split(';')
@@ -19,33 +27,57 @@ def parse_crazyxor(code):
             dictionary[var] = value
 
     for var in dictionary:
-        recursive_decode(dictionary, var)
+        evaluate(dictionary, var)
     return dictionary
 
 
-def recursive_decode(dictionary, var):
-    if var.isdigit():
-        return var
+# Resolve variable value replacing it with the decoded number.
+# Iterative depth-first evaluation so long dependency chains don't hit
+# the recursion limit, decoded variables are memoized in the dictionary.
+def evaluate(dictionary, name):
+    stack = [(name, False)]
+    visiting = set()
+    while stack:
+        var, expanded = stack.pop()
+        value = dictionary[var]
+        if value.isdigit() or '^' not in value:
+            continue
+
+        l_value, r_value = value.split('^', 1)
+        if expanded:
+            # Both operands have been decoded.
+            dictionary[var] = str(int(resolve(dictionary, l_value)) ^
+                                  int(resolve(dictionary, r_value)))
+            visiting.discard(var)
+            continue
 
-    value = dictionary[var]
-    if value.isdigit():
-        return value
-    elif '^' in value:
-        l_value, r_value = value.split('^')
-        answer = str(int(recursive_decode(dictionary, l_value)) ^
-                     int(recursive_decode(dictionary, r_value)))
-        dictionary[var] = answer
-        return answer
+        if var in visiting:
+            raise ValueError('Circular crazy XOR variable: ' + var)
+
+        visiting.add(var)
+        stack.append((var, True))
+        for operand in (l_value, r_value):
+            if not operand.isdigit() and not dictionary[operand].isdigit():
+                stack.append((operand, False))
+
+    return dictionary[name]
+
+
+def resolve(dictionary, code):
+    if code.isdigit():
+        return code
+    return dictionary[code]
 
 
 def decode_crazyxor(dictionary, code):
     if code.isdigit():
         return code
-    value = dictionary.get(code, False)
-    if value and value.isdigit():
-        return value
-    elif '^' in code:
-        l_value, r_value = code.split('^', 1)
-        answer = str(int(decode_crazyxor(dictionary, l_value)) ^
-                     int(decode_crazyxor(dictionary, r_value)))
-        return answer
+
+    answer = 0
+    for term in code.split('^'):
+        value = resolve(dictionary, term)
+        if not value.isdigit():
+            return None
+        answer ^= int(value)
+
+    return str(answer)
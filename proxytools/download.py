@@ -0,0 +1,134 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import hashlib
+import io
+import logging
+import shutil
+
+from tempfile import SpooledTemporaryFile
+from timeit import default_timer
+from zipfile import ZipFile, is_zipfile
+
+log = logging.getLogger(__name__)
+
+
+class DownloadError(Exception):
+    pass
+
+
+# Streaming download of an HTTP response into a spooled buffer.
+# Payloads are kept in memory up to `max_memory` bytes and only spill
+# into a temporary file on disk when larger. Downloads are aborted when
+# they exceed `max_size` bytes or the SHA-256 `checksum` does not match.
+class Download(object):
+    CHUNK_SIZE = 1024 * 1024
+    MAX_MEMORY = 16 * 1024 * 1024
+
+    def __init__(self, max_size=0, checksum=None, max_memory=MAX_MEMORY):
+        self.max_size = max_size
+        self.checksum = checksum
+        self.buffer = SpooledTemporaryFile(max_size=max_memory)
+        self.size = 0
+        self.digest = None
+        self.elapsed = 0.0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.buffer.close()
+
+    # Transfer rate in bytes per second.
+    def throughput(self):
+        return self.size / self.elapsed if self.elapsed else 0.0
+
+    def fetch(self, response):
+        url = response.url
+        length = response.headers.get('Content-Length')
+        if self.max_size and length and int(length) > self.max_size:
+            response.close()
+            raise DownloadError('Download from {} is too large: {} bytes.'
+                                .format(url, length))
+
+        sha256 = hashlib.sha256()
+        timer = default_timer()
+        try:
+            for chunk in response.iter_content(chunk_size=self.CHUNK_SIZE):
+                self.size += len(chunk)
+                if self.max_size and self.size > self.max_size:
+                    raise DownloadError(
+                        'Download from {} exceeded {} bytes.'.format(
+                            url, self.max_size))
+
+                sha256.update(chunk)
+                self.buffer.write(chunk)
+        finally:
+            response.close()
+
+        self.elapsed = default_timer() - timer
+        self.digest = sha256.hexdigest()
+        self.buffer.seek(0)
+
+        if self.checksum and self.checksum.lower() != self.digest:
+            raise DownloadError('Checksum mismatch on download from {}: {}.'
+                                .format(url, self.digest))
+
+        log.info('Downloaded %.1f KB in %.2fs (%.1f KB/s) from: %s',
+                 self.size / 1024.0, self.elapsed,
+                 self.throughput() / 1024.0, url)
+        return self
+
+    def is_zipfile(self):
+        self.buffer.seek(0)
+        return is_zipfile(self.buffer)
+
+    # Open first Zip archive member whose name ends with `suffix`.
+    # Returns None if there is no such member.
+    def open_member(self, zipfile, suffix):
+        for name in zipfile.namelist():
+            if name.endswith(suffix):
+                return zipfile.open(name, 'r')
+
+            log.debug('Skipped file in Zip archive: %s', name)
+
+        return None
+
+    # Stream lines from the download, or from the first Zip archive
+    # member ending with `member` if set.
+    def iter_lines(self, member=None, encoding='utf-8'):
+        self.buffer.seek(0)
+        if member is None:
+            for line in self.buffer:
+                yield line.decode(encoding, 'replace')
+            return
+
+        with ZipFile(self.buffer, 'r') as zipfile:
+            src = self.open_member(zipfile, member)
+            if src is None:
+                raise DownloadError('Unable to find {} in Zip archive.'
+                                    .format(member))
+
+            with src:
+                yield from io.TextIOWrapper(src, encoding, errors='replace')
+
+    # Save the download, or the first Zip archive member ending with
+    # `member` if set, into `filename`.
+    def extract(self, filename, member=None):
+        self.buffer.seek(0)
+        with open(filename, 'wb') as dst:
+            if member is None:
+                shutil.copyfileobj(self.buffer, dst, self.CHUNK_SIZE)
+                return
+
+            with ZipFile(self.buffer, 'r') as zipfile:
+                src = self.open_member(zipfile, member)
+                if src is None:
+                    raise DownloadError('Unable to find {} in Zip archive.'
+                                        .format(member))
+
+                with src:
+                    shutil.copyfileobj(src, dst, self.CHUNK_SIZE)
@@ -1,63 +1,292 @@
 #!/usr/bin/python
 # -*- coding: utf-8 -*-
 
-import IP2Location
+import json
 import logging
 import os
 import requests
+import struct
+import sys
+import time
 
-from zipfile import ZipFile, is_zipfile
+from array import array
+from bisect import bisect_right
+from threading import Thread
+
+from .download import Download
+from .utils import ip2int
 
 log = logging.getLogger(__name__)
 
 
+# In-memory index of IP2Location DB1 BIN file IPv4 ranges.
+# Range start addresses are kept in a sorted array and mapped to an
+# index on the country lists, lookups are done with binary search.
+class IP2LocationIndex(object):
+
+    def __init__(self, database_file):
+        self.range_starts = array('I')
+        self.range_countries = array('H')
+        self.codes = []
+        self.names = []
+
+        with open(database_file, 'rb') as fd:
+            data = fd.read()
+
+        # Header: type, columns, year, month, day, IPv4 count, IPv4 address.
+        columns, count, address = struct.unpack_from('<xBxxxII', data, 0)
+        row_size = columns * 4
+        # DB1 rows: IP range start, country pointer (extra columns skipped).
+        row_format = '<II{}x'.format(row_size - 8)
+        rows = memoryview(data)[address - 1:address - 1 + count * row_size]
+
+        countries = {}
+        for ip_from, pointer in struct.iter_unpack(row_format, rows):
+            country = countries.get(pointer)
+            if country is None:
+                country = len(self.codes)
+                countries[pointer] = country
+                code = self.__read_string(data, pointer)
+                self.codes.append(code if code != '-' else None)
+                self.names.append(
+                    self.__read_string(data, pointer + 3).lower())
+
+            self.range_starts.append(ip_from)
+            self.range_countries.append(country)
+
+        log.info('Loaded %d IP ranges from %d countries.',
+                 len(self.range_starts), len(self.codes))
+
+    def __read_string(self, data, offset):
+        size = data[offset]
+        return data[offset + 1:offset + 1 + size].decode('utf-8')
+
+    # Returns country index for IP address (integer) or None.
+    def lookup(self, ip):
+        idx = bisect_right(self.range_starts, ip) - 1
+        if idx < 0:
+            return None
+        return self.range_countries[idx]
+
+    # Returns list of country indexes for a list of IP addresses (integers).
+    def lookup_many(self, ips):
+        # Small batches are faster with binary search.
+        if len(ips) < len(self.range_starts) // 32:
+            return [self.lookup(ip) for ip in ips]
+
+        # Walk sorted addresses and ranges together.
+        result = [None] * len(ips)
+        starts = self.range_starts
+        last = len(starts) - 1
+        pos = 0
+        for idx in sorted(range(len(ips)), key=ips.__getitem__):
+            ip = ips[idx]
+            while pos < last and starts[pos + 1] <= ip:
+                pos += 1
+            if starts[pos] <= ip:
+                result[idx] = self.range_countries[pos]
+
+        return result
+
+
 class IP2LocationDatabase(object):
     URL = 'https://download.ip2location.com/lite/IP2LOCATION-LITE-DB1.BIN.ZIP'
     DATABASE_FILE = 'IP2LOCATION-LITE-DB1.BIN'
-    DATABASE_ZIP = 'IP2LOCATION-LITE-DB1.BIN.ZIP'
+
+    MAX_DOWNLOAD_SIZE = 128 * 1024 * 1024
 
     def __init__(self, args):
         self.download_path = args.download_path
+        self.refresh_interval = args.ip2location_refresh_days * 86400
+        self.ignore_country = args.proxy_ignore_country
+        self.timeout = 60
+
+        self.database_file = os.path.join(
+            args.download_path, self.DATABASE_FILE)
+        self.metadata_file = self.database_file + '.json'
+
+        self.index = None
+        self.ignore_codes = set()
 
-        database_file = os.path.join(args.download_path, self.DATABASE_FILE)
+        # Use cached database immediately, refresh it in the background.
+        # Without a database, ignored countries can not be filtered, so the
+        # first download must complete before any proxy is processed.
+        if os.path.isfile(self.database_file):
+            self.swap_index(IP2LocationIndex(self.database_file))
+        else:
+            log.info('IP2Location database not found, downloading it...')
+            if not self.download_database():
+                log.error('Unable to download IP2Location database.')
+                sys.exit(1)
 
-        if not os.path.isfile(database_file):
-            self.download_database()
+        refresher = Thread(name='ip2location-refresher',
+                           target=self.__refresh_worker)
+        refresher.daemon = True
+        refresher.start()
 
-        self.database = IP2Location.IP2Location(database_file)
+    # Atomically replace in-memory index, lookups are never paused.
+    def swap_index(self, index):
+        ignore_codes = self.resolve_countries(self.ignore_country, index)
+        self.index = index
+        self.ignore_codes = ignore_codes
+        log.info('Ignoring proxies from countries: %s',
+                 ', '.join(sorted(ignore_codes)))
+
+    def __refresh_worker(self):
+        while True:
+            wait = 0
+            if os.path.isfile(self.database_file):
+                if not self.refresh_interval:
+                    break
+                age = time.time() - os.path.getmtime(self.database_file)
+                wait = self.refresh_interval - age
+
+            if wait > 0:
+                time.sleep(wait)
+                continue
+
+            if not self.download_database():
+                # Retry failed downloads later.
+                time.sleep(3600)
+
+        log.debug('IP2Location refresher shutting down...')
+
+    def __load_metadata(self):
+        try:
+            with open(self.metadata_file, 'r') as fd:
+                return json.load(fd)
+        except (IOError, ValueError):
+            return {}
 
+    # Download Zip archive into memory and extract database from it.
     def download_database(self):
-        download_file = os.path.join(self.download_path, self.DATABASE_ZIP)
+        temp_file = self.database_file + '.tmp'
         result = False
 
         try:
-            response = requests.get(self.URL)
-            with open(download_file, 'wb') as fd:
-                for chunk in response.iter_content(chunk_size=128):
-                    fd.write(chunk)
-            response.close()
-
-            if not is_zipfile(download_file):
-                log.error('File "%s" downloaded from %s is not a Zip archive.',
-                          download_file, self.URL)
-            else:
-                with ZipFile(download_file, 'r') as myzip:
-                    for filename in myzip.namelist():
-                        if filename.endswith(self.DATABASE_FILE):
-                            myzip.extract(filename, self.download_path)
-                            result = True
-                            break
+            # Conditional request using cached database validators.
+            headers = {}
+            metadata = self.__load_metadata()
+            if os.path.isfile(self.database_file):
+                if metadata.get('etag'):
+                    headers['If-None-Match'] = metadata['etag']
+                if metadata.get('last_modified'):
+                    headers['If-Modified-Since'] = metadata['last_modified']
+
+            response = requests.get(self.URL, headers=headers, stream=True,
+                                    timeout=self.timeout)
+            if response.status_code == 304:
+                response.close()
+                log.info('IP2Location database is up to date.')
+                # Reset refresh timer.
+                os.utime(self.database_file)
+                return True
+
+            response.raise_for_status()
+            with Download(self.MAX_DOWNLOAD_SIZE) as download:
+                download.fetch(response)
+
+                # Server ignored validators but the archive is unchanged.
+                if (os.path.isfile(self.database_file) and
+                        download.digest == metadata.get('sha256')):
+                    log.info('IP2Location database is up to date.')
+                    os.utime(self.database_file)
+                    return True
+
+                if not download.is_zipfile():
+                    log.error('File downloaded from %s is not a Zip archive.',
+                              self.URL)
+                    return result
+
+                download.extract(temp_file, self.DATABASE_FILE)
+
+            # Verify new database before replacing the current one.
+            index = IP2LocationIndex(temp_file)
+            if not index.range_starts:
+                log.error('Downloaded IP2Location database has no records.')
+                return False
+
+            os.replace(temp_file, self.database_file)
+            self.swap_index(index)
+
+            with open(self.metadata_file, 'w') as fd:
+                json.dump({
+                    'etag': response.headers.get('ETag'),
+                    'last_modified': response.headers.get('Last-Modified'),
+                    'sha256': download.digest
+                }, fd)
+
+            result = True
+            log.info('IP2Location database updated.')
         except Exception as e:
             log.exception('Unable to download IP2Location Lite DB1: %s', e)
+            result = False
+        finally:
+            if os.path.isfile(temp_file):
+                os.remove(temp_file)
 
         return result
 
+    # Resolve country names or codes into a set of country codes.
+    def resolve_countries(self, countries, index=None):
+        codes = set()
+        index = index or self.index
+        if not index:
+            return codes
+
+        entries = [(code, name) for code, name
+                   in zip(index.codes, index.names) if code]
+        for country in countries:
+            country = country.strip().lower()
+            if len(country) == 2:
+                # Two letter inputs are country codes only.
+                matches = [code for code, name in entries
+                           if country == code.lower()]
+            else:
+                # Prefer an exact country name over partial matches.
+                matches = [code for code, name in entries
+                           if country == name]
+                if not matches:
+                    matches = [code for code, name in entries
+                               if country in name]
+
+            if not matches:
+                log.warning('Unable to resolve country: %s', country)
+            codes.update(matches)
+
+        return codes
+
+    def lookup_country_code(self, ip):
+        if not isinstance(ip, int):
+            ip = ip2int(ip)
+
+        index = self.index
+        if not index:
+            return None
+
+        country = index.lookup(ip)
+        if country is None:
+            return None
+        return index.codes[country]
+
+    # Batch version of lookup_country_code() for IP addresses (integers).
+    def lookup_country_codes(self, ips):
+        index = self.index
+        if not index:
+            return [None] * len(ips)
+
+        return [None if country is None else index.codes[country]
+                for country in index.lookup_many(ips)]
+
     def lookup_country(self, ip):
-        country = 'n/a'
-        try:
-            record = self.database.get_all(ip)
-            country = record.country_long.lower()
-        except Exception as e:
-            log.exception('Unable to lookup country from IP: %s', e)
+        if not isinstance(ip, int):
+            ip = ip2int(ip)
+
+        index = self.index
+        if not index:
+            return 'n/a'
 
-        return country
+        country = index.lookup(ip)
+        if country is None or not index.codes[country]:
+            return 'n/a'
+        return index.names[country]
@@ -0,0 +1,104 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import heapq
+import logging
+
+from array import array
+from bisect import bisect_left
+from threading import Lock
+
+from .models import db_step, Proxy
+
+log = logging.getLogger(__name__)
+
+
+# Exact membership set of proxy hashes stored in the database.
+# Hashes are kept in a sorted 64 bit array with small sets of pending
+# additions and removals that are merged into it once they grow, so
+# scrapped proxies already in the database are dropped without SQL.
+class KnownProxies(object):
+    COMPACT_MIN = 100000
+
+    def __init__(self):
+        self.lock = Lock()
+        self.hashes = array('Q')
+        self.added = set()
+        self.removed = set()
+
+    def __len__(self):
+        return len(self.hashes) + len(self.added) - len(self.removed)
+
+    def load(self):
+        hashes = array('Q')
+        last_hash = -1
+        while True:
+            query = (Proxy
+                     .select(Proxy.hash)
+                     .where(Proxy.hash > last_hash)
+                     .order_by(Proxy.hash.asc())
+                     .limit(db_step * 40)
+                     .tuples())
+            rows = [row[0] for row in query]
+            if not rows:
+                break
+
+            hashes.extend(rows)
+            last_hash = rows[-1]
+
+        with self.lock:
+            self.hashes = hashes
+            self.added = set()
+            self.removed = set()
+
+        log.info('Loaded %d known proxy hashes from database.', len(hashes))
+
+    # Return proxies whose hash is not known.
+    def filter(self, proxylist):
+        with self.lock:
+            result = [p for p in proxylist if not self.__contains(p['hash'])]
+
+        log.debug('Skipped %d known proxies.', len(proxylist) - len(result))
+        return result
+
+    def add(self, hashes):
+        with self.lock:
+            for proxy_hash in hashes:
+                if proxy_hash in self.removed:
+                    self.removed.discard(proxy_hash)
+                elif not self.__stored(proxy_hash):
+                    self.added.add(proxy_hash)
+            self.__compact()
+
+    def discard(self, hashes):
+        with self.lock:
+            for proxy_hash in hashes:
+                self.added.discard(proxy_hash)
+                if self.__stored(proxy_hash):
+                    self.removed.add(proxy_hash)
+            self.__compact()
+
+    def __stored(self, proxy_hash):
+        hashes = self.hashes
+        idx = bisect_left(hashes, proxy_hash)
+        return idx < len(hashes) and hashes[idx] == proxy_hash
+
+    def __contains(self, proxy_hash):
+        if proxy_hash in self.added:
+            return True
+        if proxy_hash in self.removed:
+            return False
+        return self.__stored(proxy_hash)
+
+    # Merge pending changes into the sorted array.
+    def __compact(self):
+        pending = len(self.added) + len(self.removed)
+        if pending < max(self.COMPACT_MIN, len(self.hashes) // 10):
+            return
+
+        removed = self.removed
+        self.hashes = array('Q', heapq.merge(
+            (h for h in self.hashes if h not in removed),
+            sorted(self.added)))
+        self.added = set()
+        self.removed = set()
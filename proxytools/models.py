@@ -1,17 +1,21 @@
 #!/usr/bin/python
 # -*- coding: utf-8 -*-
 
-import hashlib
+import json
 import logging
+import os
 import sys
+import time
+import zlib
 
 from peewee import (DatabaseProxy, Model, OperationalError, IntegrityError, CompositeKey,
-                    CharField, DateTimeField,
+                    fn, Case, CharField, DateTimeField,
                     IntegerField, SmallIntegerField, BigIntegerField)
 from playhouse.pool import PooledMySQLDatabase
 from playhouse.migrate import migrate, MySQLMigrator
 
 from datetime import datetime, timedelta
+from timeit import default_timer
 
 from .utils import ip2int, int2ip
 
@@ -20,11 +24,15 @@ log = logging.getLogger(__name__)
 
 # http://docs.peewee-orm.com/en/latest/peewee/database.html#dynamically-defining-a-database
 db = DatabaseProxy()
-db_schema_version = 3
+db_schema_version = 10
 db_step = 250
+db_insert_batch = 5000
+db_rank_window = 10
+rehash_checkpoint = 'rehash-checkpoint.json'
 
 # Connect to a MySQL database on network.
-def init_database(db_name, db_host, db_port, db_user, db_pass):
+def init_database(db_name, db_host, db_port, db_user, db_pass,
+                  local_infile=False, download_path='.'):
     log.info('Connecting to MySQL database on %s:%i...', db_host, db_port)
 
     database = PooledMySQLDatabase(
@@ -35,19 +43,34 @@ def init_database(db_name, db_host, db_port, db_user, db_pass):
         port=db_port,
         stale_timeout=60,
         max_connections=None,
+        local_infile=local_infile,
         charset='utf8mb4')
 
     # Initialize Database Proxy
     db.initialize(database)
 
     try:
-        verify_database_schema()
+        verify_database_schema(
+            os.path.join(download_path, rehash_checkpoint))
         verify_table_encoding(db_name)
     except Exception as e:
         log.exception('Failed to verify database schema: %s', e)
         sys.exit(1)
     return db
 
+# Format a value for LOAD DATA with default field and line terminators.
+def load_data_format(value):
+    if value is None:
+        return '\\N'
+    if isinstance(value, datetime):
+        return value.strftime('%Y-%m-%d %H:%M:%S')
+
+    return (str(value)
+            .replace('\\', '\\\\')
+            .replace('\t', '\\t')
+            .replace('\n', '\\n'))
+
+
 # Custom fields
 class Utf8mb4CharField(CharField):
     def __init__(self, max_length=191, *args, **kwargs):
@@ -95,29 +118,39 @@ class ProxyStatus:
 
 
 class Proxy(BaseModel):
-    hash = UIntegerField(unique=True)
+    hash = UBigIntegerField(unique=True)
     ip = UIntegerField()
     port = USmallIntegerField()
-    protocol = USmallIntegerField(index=True)
+    protocol = USmallIntegerField()
     username = Utf8mb4CharField(null=True, max_length=32)
     password = Utf8mb4CharField(null=True, max_length=32)
-    insert_date = DateTimeField(index=True, default=datetime.utcnow)
-    scan_date = DateTimeField(index=True, null=True)
-    latency = UIntegerField(index=True, null=True)
-    fail_count = UIntegerField(index=True, default=0)
-    anonymous = USmallIntegerField(index=True, default=ProxyStatus.UNKNOWN)
-    niantic = USmallIntegerField(index=True, default=ProxyStatus.UNKNOWN)
-    ptc_login = USmallIntegerField(index=True, default=ProxyStatus.UNKNOWN)
-    ptc_signup = USmallIntegerField(index=True, default=ProxyStatus.UNKNOWN)
+    insert_date = DateTimeField(default=datetime.utcnow)
+    scan_date = DateTimeField(null=True)
+    latency = UIntegerField(null=True)
+    fail_count = UIntegerField(default=0)
+    anonymous = USmallIntegerField(default=ProxyStatus.UNKNOWN)
+    niantic = USmallIntegerField(default=ProxyStatus.UNKNOWN)
+    ptc_login = USmallIntegerField(default=ProxyStatus.UNKNOWN)
+    ptc_signup = USmallIntegerField(default=ProxyStatus.UNKNOWN)
+    country = Utf8mb4CharField(null=True, max_length=2)
+    # Bitmask of scrapper sources where proxy was found (SOURCE_ID bits).
+    sources = UIntegerField(default=0)
+    lease_owner = Utf8mb4CharField(index=True, null=True, max_length=64)
+    lease_expiry = DateTimeField(null=True)
 
     class Meta:
         primary_key = CompositeKey('ip', 'port')
 
     @staticmethod
     def db_format(proxy):
+        ip = proxy['ip']
+        # Check if proxy IP is already packed.
+        if not isinstance(ip, int):
+            ip = ip2int(ip)
+
         return {
             'hash': proxy['hash'],
-            'ip': ip2int(proxy['ip']),
+            'ip': ip,
             'port': proxy['port'],
             'protocol': proxy['protocol'],
             'username': proxy['username'],
@@ -129,28 +162,37 @@ class Proxy(BaseModel):
             'anonymous': proxy.get('anonymous', ProxyStatus.UNKNOWN),
             'niantic': proxy.get('niantic', ProxyStatus.UNKNOWN),
             'ptc_login': proxy.get('ptc_login', ProxyStatus.UNKNOWN),
-            'ptc_signup': proxy.get('ptc_signup', ProxyStatus.UNKNOWN)}
-
+            'ptc_signup': proxy.get('ptc_signup', ProxyStatus.UNKNOWN),
+            'country': proxy.get('country', None),
+            'sources': proxy.get('sources', 0),
+            'lease_owner': None,
+            'lease_expiry': None}
+
+    # 64 bit proxy hash built from packed integer fields:
+    # credentials checksum (16 bits) | IP (32 bits) | port (16 bits).
+    # Proxies with distinct IP and port never collide.
     @staticmethod
     def generate_hash(proxy):
+        ip = proxy['ip']
         # Check if proxy is already formatted for database.
-        if isinstance(proxy['ip'], int):
-            ip = int2ip(proxy['ip'])
-            port = str(proxy['port'])
-        else:
-            ip = proxy['ip']
-            port = proxy['port']
+        if not isinstance(ip, int):
+            ip = ip2int(ip)
 
-        hasher = hashlib.md5()
-        hasher.update(ip.encode('utf-8'))
-        hasher.update(port.encode('utf-8'))
+        credentials = 0
         if proxy['username']:
-            hasher.update(proxy['username'])
-        if proxy['password']:
-            hasher.update(proxy['password'])
+            credentials = zlib.crc32('{}:{}'.format(
+                proxy['username'], proxy['password'] or '').encode('utf-8'))
 
-        # 4 bit * 8 hex chars = 32 bit = 4 bytes
-        return int(hasher.hexdigest()[:8], 16)
+        return ((credentials & 0xFFFF) << 48) | (ip << 16) | int(proxy['port'])
+
+    # Compute and set hashes on a list of proxies.
+    @staticmethod
+    def generate_hashes(proxylist):
+        generate_hash = Proxy.generate_hash
+        for proxy in proxylist:
+            proxy['hash'] = generate_hash(proxy)
+
+        return proxylist
 
     @staticmethod
     def url_format(proxy, no_protocol=False):
@@ -206,7 +248,8 @@ class Proxy(BaseModel):
         return None
 
     @staticmethod
-    def get_valid(limit=1000, anonymous=True, age_secs=3600, protocol=None):
+    def get_valid(limit=1000, anonymous=True, age_secs=3600, protocol=None,
+                  ignore_countries=None):
         result = []
         max_age = datetime.utcnow() - timedelta(seconds=age_secs)
         conditions = ((Proxy.scan_date > max_age) &
@@ -220,6 +263,10 @@ class Proxy(BaseModel):
         if protocol is not None:
             conditions &= (Proxy.protocol == protocol)
 
+        if ignore_countries:
+            conditions &= (Proxy.country.is_null() |
+                           Proxy.country.not_in(ignore_countries))
+
         try:
             query = (Proxy
                      .select()
@@ -239,27 +286,73 @@ class Proxy(BaseModel):
         return result
 
     @staticmethod
-    def get_scan(limit=1000, exclude=[], age_secs=3600, protocol=None):
-        result = []
-        min_age = datetime.utcnow() - timedelta(seconds=age_secs)
+    def scan_conditions(age_secs=3600, protocol=None, ignore_countries=None):
+        now = datetime.utcnow()
+        min_age = now - timedelta(seconds=age_secs)
         conditions = (((Proxy.scan_date < min_age) & (Proxy.fail_count < 5)) |
                       Proxy.scan_date.is_null())
-        if exclude:
-            conditions &= (Proxy.hash.not_in(exclude))
+        # Skip proxies leased by other proxy testers.
+        conditions &= (Proxy.lease_expiry.is_null() |
+                       (Proxy.lease_expiry < now))
 
         if protocol is not None:
             conditions &= (Proxy.protocol == protocol)
 
+        # Proxies without country are geolocated when tested.
+        if ignore_countries:
+            conditions &= (Proxy.country.is_null() |
+                           Proxy.country.not_in(ignore_countries))
+
+        return conditions
+
+    # Pick proxies never tested by the quality of their sources.
+    # A window of `limit` * db_rank_window proxies is read in index order
+    # (oldest first) and ranked in Python, sorting on an expression of the
+    # sources would have MySQL sort every proxy never tested.
+    # Priorities format: [(sources mask, score), ...] by descending score.
+    @staticmethod
+    def rank_unscanned(conditions, limit, priorities, fields=None):
+        query = (Proxy
+                 .select(*(fields or [Proxy]))
+                 .where(conditions & Proxy.scan_date.is_null())
+                 .order_by(Proxy.insert_date.asc())
+                 .limit(limit * db_rank_window)
+                 .dicts())
+
+        # Stable sort keeps oldest proxies first among equal priorities.
+        window = list(query)
+        window.sort(key=lambda proxy: SourceStats.priority(
+            proxy['sources'], priorities), reverse=True)
+        return window[:limit]
+
+    # Select proxies to scan, proxies never tested come first and are
+    # ordered by the quality of their sources if `priorities` are given.
+    @staticmethod
+    def get_scan(limit=1000, exclude=[], age_secs=3600, protocol=None,
+                 ignore_countries=None, priorities=None):
+        result = []
+        conditions = Proxy.scan_conditions(age_secs, protocol,
+                                           ignore_countries)
+        if exclude:
+            conditions &= (Proxy.hash.not_in(exclude))
+
         try:
-            query = (Proxy
-                     .select()
-                     .where(conditions)
-                     .order_by(Proxy.scan_date.asc(),
-                               Proxy.insert_date.asc())
-                     .limit(limit)
-                     .dicts())
+            proxylist = []
+            if priorities:
+                proxylist = Proxy.rank_unscanned(conditions, limit, priorities)
+                conditions &= Proxy.scan_date.is_null(False)
 
-            for proxy in query:
+            if len(proxylist) < limit:
+                query = (Proxy
+                         .select()
+                         .where(conditions)
+                         .order_by(Proxy.scan_date.asc(),
+                                   Proxy.insert_date.asc())
+                         .limit(limit - len(proxylist))
+                         .dicts())
+                proxylist.extend(query)
+
+            for proxy in proxylist:
                 proxy['ip'] = int2ip(proxy['ip'])
                 proxy['url'] = Proxy.url_format(proxy)
                 result.append(proxy)
@@ -267,75 +360,594 @@ class Proxy(BaseModel):
         except OperationalError as e:
             log.exception('Failed to get proxies to scan from database: %s', e)
 
-        return query
+        return result
 
-    # Filter proxylist and insert only new proxies to the database.
+    # Atomically select and lease a batch of proxies to scan.
+    # Leases expire after `lease_secs` and are released when the test
+    # result is written, so testers sharing a database never overlap.
+    # Proxies in `exclude` are still being tested and are never claimed.
     @staticmethod
-    def insert_new(proxylist):
-        log.info('Processing %d proxies into the database.', len(proxylist))
-        count = 0
-        for idx in range(0, len(proxylist), db_step):
-            batch = proxylist[idx:idx + db_step]
-            proxies = [p['hash'] for p in batch]
-            try:
+    def claim_scan(owner, limit=1000, lease_secs=600, age_secs=3600,
+                   exclude=[], protocol=None, ignore_countries=None,
+                   priorities=None):
+        result = []
+        lease_expiry = datetime.utcnow() + timedelta(seconds=lease_secs)
+        conditions = Proxy.scan_conditions(age_secs, protocol,
+                                           ignore_countries)
+        if exclude:
+            conditions &= (Proxy.hash.not_in(exclude))
+
+        try:
+            with db.atomic():
+                claimed = 0
+                if priorities:
+                    # Same order as Proxy.get_scan() with source priorities.
+                    # Scan conditions are checked again when claiming, in
+                    # case another tester leased some of the proxies.
+                    hashes = [proxy['hash'] for proxy in Proxy.rank_unscanned(
+                        conditions, limit, priorities,
+                        (Proxy.hash, Proxy.sources))]
+                    if hashes:
+                        claimed += (Proxy
+                                    .update(lease_owner=owner,
+                                            lease_expiry=lease_expiry)
+                                    .where(conditions &
+                                           (Proxy.hash << hashes))
+                                    .execute())
+                    conditions &= Proxy.scan_date.is_null(False)
+
+                if claimed < limit:
+                    # MySQL supports ORDER BY and LIMIT on single table
+                    # updates.
+                    sql, params = (Proxy
+                                   .update(lease_owner=owner,
+                                           lease_expiry=lease_expiry)
+                                   .where(conditions)
+                                   .sql())
+                    sql += (' ORDER BY `scan_date` ASC, `insert_date` ASC'
+                            ' LIMIT %s')
+                    cursor = db.execute_sql(sql, params + [limit - claimed])
+                    claimed += cursor.rowcount
+
+                if not claimed:
+                    return result
+
                 query = (Proxy
-                         .select(Proxy.hash)
-                         .where(Proxy.hash << proxies)
+                         .select()
+                         .where(Proxy.lease_owner == owner)
                          .dicts())
 
-                db_proxies = [dbp['hash'] for dbp in query]
+                for proxy in query:
+                    proxy['ip'] = int2ip(proxy['ip'])
+                    proxy['url'] = Proxy.url_format(proxy)
+                    result.append(proxy)
 
-                new_proxies = [Proxy.db_format(x)
-                               for x in batch if x['hash'] not in db_proxies]
-                if not new_proxies:
-                    continue
+        except OperationalError as e:
+            log.exception('Failed to claim proxies to scan from database: %s',
+                          e)
+
+        return result
 
+    # Insert new proxies, duplicates are ignored by the database.
+    # Returns the number of proxies actually inserted.
+    @staticmethod
+    def insert_new(proxylist, batch_size=db_insert_batch):
+        log.info('Processing %d proxies into the database.', len(proxylist))
+        count = 0
+        for idx in range(0, len(proxylist), batch_size):
+            batch = [Proxy.db_format(proxy)
+                     for proxy in proxylist[idx:idx + batch_size]]
+            try:
+                query = Proxy.insert_many(batch).on_conflict_ignore()
                 with db.atomic():
-                    query = Proxy.insert_many(new_proxies).execute()
-                    if query:
-                        count += len(new_proxies)
+                    cursor = db.execute(query)
+                    count += cursor.rowcount
             except IntegrityError as e:
                 log.exception('Unable to insert new proxies: %s', e)
             except OperationalError as e:
                 log.exception('Failed to insert new proxies: %s', e)
 
         log.info('Inserted %d new proxies into the database.', count)
+        return count
 
+    # Hashes of proxies in `hashes` that were inserted at `insert_date`.
     @staticmethod
-    def clean_failed():
-        rows = 0
-        try:
-            with db:
+    def get_inserted(hashes, insert_date):
+        result = set()
+        for idx in range(0, len(hashes), db_step):
+            try:
                 query = (Proxy
+                         .select(Proxy.hash)
+                         .where((Proxy.hash << hashes[idx:idx + db_step]) &
+                                (Proxy.insert_date == insert_date))
+                         .tuples())
+                result.update(row[0] for row in query)
+            except OperationalError as e:
+                log.exception('Failed to get inserted proxies: %s', e)
+
+        return result
+
+    # Merge source bitmasks of proxies into the database, only rows
+    # missing some of the source bits are written.
+    @staticmethod
+    def add_sources(proxylist, batch_size=db_insert_batch):
+        groups = {}
+        for proxy in proxylist:
+            if proxy.get('sources'):
+                groups.setdefault(proxy['sources'], []).append(proxy['hash'])
+
+        count = 0
+        for mask, hashes in groups.items():
+            for idx in range(0, len(hashes), batch_size):
+                batch = hashes[idx:idx + batch_size]
+                try:
+                    count += (Proxy
+                              .update(sources=Proxy.sources.bin_or(mask))
+                              .where((Proxy.hash << batch) &
+                                     (Proxy.sources.bin_and(mask) != mask))
+                              .execute())
+                except OperationalError as e:
+                    log.exception('Failed to update proxy sources: %s', e)
+
+        log.debug('Updated sources of %d proxies.', count)
+        return count
+
+    # Stream proxies into a tab separated file and bulk load it into the
+    # database with LOAD DATA, duplicates are ignored by the database.
+    # Returns the number of proxies inserted or None if loading failed.
+    @staticmethod
+    def load_data(proxylist, filename):
+        log.info('Bulk loading proxies into the database from: %s', filename)
+        rows = None
+        columns = [f.column_name for f in Proxy._meta.sorted_fields]
+        try:
+            with open(filename, 'w', encoding='utf-8') as fd:
+                for proxy in proxylist:
+                    proxy = Proxy.db_format(proxy)
+                    fd.write('\t'.join(
+                        load_data_format(proxy[c]) for c in columns))
+                    fd.write('\n')
+
+            with db.atomic():
+                cursor = db.execute_sql(
+                    'LOAD DATA LOCAL INFILE %s IGNORE INTO TABLE `proxy` '
+                    'CHARACTER SET utf8mb4 '
+                    "FIELDS TERMINATED BY '\\t' LINES TERMINATED BY '\\n' "
+                    '({});'.format(', '.join('`{}`'.format(c)
+                                            for c in columns)),
+                    (os.path.abspath(filename),))
+                rows = cursor.rowcount
+
+            log.info('Inserted %d new proxies into the database.', rows)
+        except Exception as e:
+            log.exception('Failed to bulk load proxies: %s', e)
+        finally:
+            if os.path.isfile(filename):
+                os.remove(filename)
+
+        return rows
+
+    # Delete proxies matching `conditions` in small chunks, pausing between
+    # chunks to let other queries through, until `time_budget` runs out.
+    # Deleted hashes are appended to `deleted` list if provided.
+    @staticmethod
+    def purge(conditions, chunk_size=1000, pause=0.1, time_budget=30,
+              deleted=None):
+        rows = 0
+        timer = default_timer()
+        while default_timer() - timer < time_budget:
+            query = (Proxy
+                     .select(Proxy.hash)
+                     .where(conditions)
+                     .limit(chunk_size)
+                     .tuples())
+            hashes = [row[0] for row in query]
+            if not hashes:
+                break
+
+            with db.atomic():
+                rows += (Proxy
                          .delete()
-                         .where(Proxy.fail_count >= 5))
-                rows = query.execute()
+                         .where(Proxy.hash << hashes)
+                         .execute())
+
+            if deleted is not None:
+                deleted.extend(hashes)
+
+            if len(hashes) < chunk_size:
+                break
+
+            time.sleep(pause)
+
+        return rows
+
+    # Delete proxies that failed too many tests, that will never be
+    # scanned because their country is ignored and, if `expire_days` is
+    # set, proxies that never passed all tests after that many days.
+    @staticmethod
+    def clean_failed(chunk_size=1000, pause=0.1, time_budget=30,
+                     expire_days=0, deleted=None, ignore_countries=None):
+        rows = 0
+        timer = default_timer()
+        try:
+            rows = Proxy.purge(Proxy.fail_count >= 5,
+                               chunk_size, pause, time_budget, deleted)
+            log.info('Deleted %d failed proxies from database.', rows)
+
+            if ignore_countries:
+                time_budget -= default_timer() - timer
+                rows = Proxy.purge(Proxy.country << ignore_countries,
+                                   chunk_size, pause, time_budget, deleted)
+                log.info('Deleted %d proxies from ignored countries.', rows)
+
+            if expire_days:
+                # Expire proxies that never passed all tests.
+                max_age = datetime.utcnow() - timedelta(days=expire_days)
+                time_budget -= default_timer() - timer
+                rows = Proxy.purge((Proxy.insert_date < max_age) &
+                                   Proxy.latency.is_null(),
+                                   chunk_size, pause, time_budget, deleted)
+                log.info('Deleted %d expired proxies from database.', rows)
+
         except OperationalError as e:
             log.exception('Failed to delete failed proxies: %s', e)
 
-        log.info('Deleted %d failed proxies from database.', rows)
-
+    # Re-hash proxies in chunks using keyset pagination on primary key.
+    # Progress is saved to a checkpoint file to resume if interrupted.
     @staticmethod
-    def rehash_all():
+    def rehash_all(checkpoint_file=None, chunk_size=db_insert_batch):
         rows = 0
-        query = Proxy.select().dicts().execute()
-        log.info('Re-hashing proxies on the database.')
-        for proxy in query:
-            try:
+        processed = 0
+        last_ip, last_port = -1, -1
+
+        if checkpoint_file and os.path.isfile(checkpoint_file):
+            with open(checkpoint_file, 'r') as fd:
+                checkpoint = json.load(fd)
+            last_ip, last_port = checkpoint['ip'], checkpoint['port']
+            rows, processed = checkpoint['rows'], checkpoint['processed']
+            log.info('Resuming proxy re-hashing after %d proxies.', processed)
+        else:
+            log.info('Re-hashing proxies on the database.')
+
+        resumed = processed
+        timer = default_timer()
+        while True:
+            query = (Proxy
+                     .select(Proxy.hash, Proxy.ip, Proxy.port,
+                             Proxy.username, Proxy.password)
+                     .where((Proxy.ip > last_ip) |
+                            ((Proxy.ip == last_ip) & (Proxy.port > last_port)))
+                     .order_by(Proxy.ip.asc(), Proxy.port.asc())
+                     .limit(chunk_size)
+                     .dicts())
+            proxies = list(query)
+            if not proxies:
+                break
+
+            changes = []
+            for proxy in proxies:
                 proxy_hash = Proxy.generate_hash(proxy)
                 if proxy_hash != proxy['hash']:
-                    proxy['hash'] = proxy_hash
-                    query = (Proxy
-                             .update(hash=proxy_hash)
-                             .where((Proxy.ip == proxy['ip']) &
-                                    (Proxy.port == proxy['port'])))
-                    if query.execute():
-                        rows += 1
+                    changes.append((proxy['ip'], proxy['port'], proxy_hash))
+
+            with db.atomic():
+                for idx in range(0, len(changes), db_step):
+                    rows += Proxy.update_hashes(changes[idx:idx + db_step])
 
-            except Exception as e:
-                log.exception('Failed to re-hash proxy: %s', e)
+            processed += len(proxies)
+            last_ip, last_port = proxies[-1]['ip'], proxies[-1]['port']
+
+            if checkpoint_file:
+                with open(checkpoint_file, 'w') as fd:
+                    json.dump({'ip': last_ip, 'port': last_port,
+                               'rows': rows, 'processed': processed}, fd)
+
+            elapsed = default_timer() - timer
+            log.info('Re-hashing progress: %d proxies processed, %d updated '
+                     '(%d rows/s).', processed, rows,
+                     (processed - resumed) / elapsed if elapsed else 0)
+
+        if checkpoint_file and os.path.isfile(checkpoint_file):
+            os.remove(checkpoint_file)
 
         log.info('Re-hashed %d proxies on the database.', rows)
+        return rows
+
+    # Update hashes with a single CASE statement.
+    # Changes format: [(ip, port, hash), ...]
+    @staticmethod
+    def update_hashes(changes):
+        if not changes:
+            return 0
+
+        case = Case(None, [((Proxy.ip == ip) & (Proxy.port == port), h)
+                           for ip, port, h in changes], Proxy.hash)
+        query = (Proxy
+                 .update(hash=case)
+                 .where(Proxy.ip << list(set(c[0] for c in changes))))
+        return query.execute()
+
+
+# Composite indexes matching the proxy scan and valid proxy queries.
+PROXY_INDEXES = (
+    # Proxy.get_scan() and Proxy.claim_scan(): order by scan date and
+    # insertion date, remaining filters are checked from index entries.
+    ('proxy_scan', ('scan_date', 'insert_date', 'fail_count', 'protocol',
+                    'lease_expiry')),
+    # Proxy.get_valid(): equality filters on test statuses, ordered by
+    # latency with the optional filters checked from index entries.
+    ('proxy_valid', ('fail_count', 'niantic', 'ptc_login', 'ptc_signup',
+                     'latency', 'scan_date', 'anonymous', 'protocol')),
+    # Proxy.clean_failed(): expired proxies that never passed all tests.
+    ('proxy_expiry', ('insert_date', 'latency')),
+    # Proxy.clean_failed(): proxies from ignored countries.
+    ('proxy_country', ('country',))
+)
+
+for index_name, index_fields in PROXY_INDEXES:
+    Proxy.add_index(
+        Proxy.index(*[getattr(Proxy, f) for f in index_fields],
+                    name=index_name))
+
+
+# Append-only history of proxy test results.
+class ProxyTest(BaseModel):
+    hash = UBigIntegerField()
+    date = DateTimeField(default=datetime.utcnow)
+    latency = UIntegerField(null=True)
+    anonymous = USmallIntegerField()
+    niantic = USmallIntegerField()
+    ptc_login = USmallIntegerField()
+    ptc_signup = USmallIntegerField()
+
+    class Meta:
+        indexes = (
+            (('hash', 'date'), False),
+            (('date',), False),
+        )
+
+    @staticmethod
+    def db_format(proxy):
+        return {
+            'hash': proxy['hash'],
+            'date': proxy['scan_date'],
+            'latency': proxy['latency'] if proxy['fail_count'] == 0 else None,
+            'anonymous': proxy['anonymous'],
+            'niantic': proxy['niantic'],
+            'ptc_login': proxy['ptc_login'],
+            'ptc_signup': proxy['ptc_signup']}
+
+    # Results that could not be inserted are appended to `failed` list if
+    # provided.
+    @staticmethod
+    def insert_results(results, failed=None):
+        count = 0
+        for idx in range(0, len(results), db_insert_batch):
+            batch = results[idx:idx + db_insert_batch]
+            try:
+                with db.atomic():
+                    ProxyTest.insert_many(batch).execute()
+                count += len(batch)
+            except OperationalError as e:
+                log.exception('Failed to insert proxy test results: %s', e)
+                if failed is not None:
+                    failed.extend(batch)
+
+        return count
+
+    # Delete test results older than `age_days` in chunks by primary key.
+    @staticmethod
+    def prune(age_days, chunk_size=db_insert_batch):
+        rows = 0
+        max_age = datetime.utcnow() - timedelta(days=age_days)
+        try:
+            while True:
+                query = (ProxyTest
+                         .select(ProxyTest.id)
+                         .where(ProxyTest.date < max_age)
+                         .order_by(ProxyTest.id.asc())
+                         .limit(chunk_size)
+                         .tuples())
+                ids = [row[0] for row in query]
+                if not ids:
+                    break
+
+                with db.atomic():
+                    rows += (ProxyTest
+                             .delete()
+                             .where(ProxyTest.id << ids)
+                             .execute())
+
+            # Remove statistics without recent test results.
+            (ProxyStats
+             .delete()
+             .where(ProxyStats.update_date < max_age)
+             .execute())
+        except OperationalError as e:
+            log.exception('Failed to prune proxy test results: %s', e)
+
+        log.info('Deleted %d old proxy test results from database.', rows)
+        return rows
+
+
+# Per-proxy aggregates computed from the proxy test history.
+# Ratios are stored in per mille (0 - 1000).
+class ProxyStats(BaseModel):
+    hash = UBigIntegerField(primary_key=True)
+    tests = UIntegerField(default=0)
+    pass_ratio = USmallIntegerField(default=0)
+    uptime = USmallIntegerField(default=0)
+    latency_p50 = UIntegerField(null=True)
+    update_date = DateTimeField(default=datetime.utcnow)
+
+    @staticmethod
+    def aggregate(proxy_hash, tests, now):
+        passes = [t for t in tests if t['latency'] is not None]
+        latencies = sorted(t['latency'] for t in passes)
+
+        # Uptime: fraction of the observed period a proxy was passing,
+        # each result holds until the next test (or now).
+        period = (now - tests[0]['date']).total_seconds()
+        up = 0
+        for idx, test in enumerate(tests):
+            if test['latency'] is None:
+                continue
+            if idx + 1 < len(tests):
+                end = tests[idx + 1]['date']
+            else:
+                end = now
+            up += (end - test['date']).total_seconds()
+
+        return {
+            'hash': proxy_hash,
+            'tests': len(tests),
+            'pass_ratio': len(passes) * 1000 // len(tests),
+            'uptime': int(up * 1000 / period) if period > 0 else (
+                1000 if passes else 0),
+            'latency_p50': (latencies[len(latencies) // 2]
+                            if latencies else None),
+            'update_date': now}
+
+    # Uptime of proxies in `hashes` that have statistics.
+    # Returns a dictionary: {hash: uptime}
+    @staticmethod
+    def get_uptimes(hashes):
+        result = {}
+        hashes = list(hashes)
+        for idx in range(0, len(hashes), db_step):
+            try:
+                query = (ProxyStats
+                         .select(ProxyStats.hash, ProxyStats.uptime)
+                         .where(ProxyStats.hash << hashes[idx:idx + db_step])
+                         .tuples())
+                result.update(query)
+            except OperationalError as e:
+                log.exception('Failed to get proxy statistics: %s', e)
+
+        return result
+
+    # Recompute aggregates for `hashes` from the last `age_days` of history.
+    # Returns the updated uptimes: {hash: uptime}
+    @staticmethod
+    def rollup(hashes, age_days):
+        now = datetime.utcnow()
+        min_age = now - timedelta(days=age_days)
+        hashes = list(hashes)
+        uptimes = {}
+        for idx in range(0, len(hashes), db_step):
+            batch = hashes[idx:idx + db_step]
+            try:
+                query = (ProxyTest
+                         .select(ProxyTest.hash, ProxyTest.date,
+                                 ProxyTest.latency)
+                         .where((ProxyTest.hash << batch) &
+                                (ProxyTest.date > min_age))
+                         .order_by(ProxyTest.hash, ProxyTest.date)
+                         .dicts())
+
+                history = {}
+                for test in query:
+                    history.setdefault(test['hash'], []).append(test)
+
+                stats = [ProxyStats.aggregate(h, tests, now)
+                         for h, tests in history.items()]
+                if not stats:
+                    continue
+
+                with db.atomic():
+                    (ProxyStats
+                     .insert_many(stats)
+                     .on_conflict_replace()
+                     .execute())
+                uptimes.update((s['hash'], s['uptime']) for s in stats)
+            except OperationalError as e:
+                log.exception('Failed to update proxy statistics: %s', e)
+
+        log.debug('Updated statistics for %d proxies.', len(uptimes))
+        return uptimes
+
+
+# Per-source aggregates of the first test of each scrapped proxy.
+# Sources are identified by scrapper SOURCE_ID.
+class SourceStats(BaseModel):
+    # Score of sources without tests and proxies without source.
+    PRIOR_SCORE = 500
+
+    source = USmallIntegerField(primary_key=True)
+    tests = UIntegerField(default=0)
+    passes = UIntegerField(default=0)
+    update_date = DateTimeField(default=datetime.utcnow)
+
+    # Add test results to aggregates.
+    # Results format: {source: [tests, passes], ...}
+    @staticmethod
+    def record(results):
+        if not results:
+            return 0
+
+        now = datetime.utcnow()
+        rows = [{'source': source, 'tests': tests, 'passes': passes,
+                 'update_date': now}
+                for source, (tests, passes) in results.items()]
+        try:
+            with db.atomic():
+                (SourceStats
+                 .insert_many(rows)
+                 .on_conflict(update={
+                     SourceStats.tests: (SourceStats.tests +
+                                         fn.VALUES(SourceStats.tests)),
+                     SourceStats.passes: (SourceStats.passes +
+                                          fn.VALUES(SourceStats.passes)),
+                     SourceStats.update_date: now})
+                 .execute())
+        except OperationalError as e:
+            log.exception('Failed to update source statistics: %s', e)
+            return 0
+
+        return len(rows)
+
+    @staticmethod
+    def get_stats():
+        result = {}
+        try:
+            for row in SourceStats.select().dicts():
+                result[row['source']] = row
+        except OperationalError as e:
+            log.exception('Failed to get source statistics: %s', e)
+
+        return result
+
+    # Pass ratio in per mille with a uniform prior, so sources with few
+    # tests are not starved before their quality is known.
+    @staticmethod
+    def score(tests, passes):
+        return (passes + 1) * 1000 // (tests + 2)
+
+    # Source priorities for Proxy.get_scan() and Proxy.claim_scan():
+    # [(sources mask, score), ...] ordered by descending score.
+    # Sources without statistics share a single entry with prior score.
+    @staticmethod
+    def get_priorities():
+        priorities = []
+        known = 0
+        for source, stats in SourceStats.get_stats().items():
+            mask = 1 << source
+            known |= mask
+            priorities.append(
+                (mask, SourceStats.score(stats['tests'], stats['passes'])))
+
+        priorities.append((~known & 0xFFFFFFFF, SourceStats.PRIOR_SCORE))
+        priorities.sort(key=lambda p: p[1], reverse=True)
+        return priorities
+
+    # Score of a sources bitmask, its best source score.
+    @staticmethod
+    def priority(sources, priorities):
+        for mask, score in priorities:
+            if sources & mask:
+                return score
+
+        return SourceStats.PRIOR_SCORE
 
 
 class Version(BaseModel):
@@ -345,7 +957,7 @@ class Version(BaseModel):
     class Meta:
         primary_key = False
 
-MODELS = [Proxy, Version]
+MODELS = [Proxy, ProxyTest, ProxyStats, SourceStats, Version]
 
 def create_tables():
     with db:
@@ -369,34 +981,45 @@ def drop_tables():
         db.execute_sql('SET FOREIGN_KEY_CHECKS=1;')
 
 
-def migrate_database_schema(old_ver):
-    log.info('Detected database version %i, updating to %i...',
-             old_ver, db_schema_version)
-
+def update_schema_version(version):
     with db:
-        # Update database schema version.
         query = (Version
-                 .update(val=db_schema_version)
+                 .update(val=version)
                  .where(Version.key == 'schema_version'))
         query.execute()
 
+
+def has_index(table, index_name):
+    return any(index.name == index_name for index in db.get_indexes(table))
+
+
+# Each migration step records its schema version once complete, so an
+# interrupted upgrade resumes from the step that failed. Steps that
+# re-hash proxies continue from `checkpoint_file`.
+def migrate_database_schema(old_ver, checkpoint_file=None):
+    log.info('Detected database version %i, updating to %i...',
+             old_ver, db_schema_version)
+
     # Perform migrations here.
     migrator = MySQLMigrator(db)
 
     if old_ver < 2:
         # Remove hash field unique index.
-        migrate(migrator.drop_index('proxy', 'proxy_hash'))
-        # Reset hash field in all proxies.
-        Proxy.update(hash=1).execute()
-        # Modify column type.
+        if has_index('proxy', 'proxy_hash'):
+            migrate(migrator.drop_index('proxy', 'proxy_hash'))
+        # Reset hash field in all proxies, unless resuming re-hashing.
+        if not (checkpoint_file and os.path.isfile(checkpoint_file)):
+            Proxy.update(hash=1).execute()
+        # Modify column type (widened to 64 bits since schema v7).
         db.execute_sql(
             'ALTER TABLE `proxy` '
-            'CHANGE COLUMN `hash` `hash` INT UNSIGNED NOT NULL;'
+            'CHANGE COLUMN `hash` `hash` BIGINT UNSIGNED NOT NULL;'
         )
         # Re-hash all proxies.
-        Proxy.rehash_all()
+        Proxy.rehash_all(checkpoint_file)
         # Recreate hash field unique index.
         migrate(migrator.add_index('proxy', ('hash',), True))
+        update_schema_version(2)
 
     if old_ver < 3:
         # Add response time field.
@@ -404,13 +1027,97 @@ def migrate_database_schema(old_ver):
             migrator.add_column('proxy', 'latency',
                                 UIntegerField(index=True, null=True))
         )
+        update_schema_version(3)
+
+    if old_ver < 4:
+        # Add lease fields for claiming proxies to scan.
+        migrate(
+            migrator.add_column('proxy', 'lease_owner',
+                                Utf8mb4CharField(index=True, null=True,
+                                                 max_length=64)),
+            migrator.add_column('proxy', 'lease_expiry',
+                                DateTimeField(null=True))
+        )
+        update_schema_version(4)
+
+    if old_ver < 5:
+        # Replace single column indexes with composite query indexes.
+        for field in ('protocol', 'insert_date', 'scan_date', 'latency',
+                      'fail_count', 'anonymous', 'niantic', 'ptc_login',
+                      'ptc_signup'):
+            if has_index('proxy', 'proxy_' + field):
+                migrate(migrator.drop_index('proxy', 'proxy_' + field))
+
+        # Indexes up to schema v5, later ones need newer columns.
+        for index_name, index_fields in PROXY_INDEXES[:2]:
+            if not has_index('proxy', index_name):
+                db.execute_sql('CREATE INDEX `{}` ON `proxy` ({});'.format(
+                    index_name,
+                    ', '.join('`{}`'.format(f) for f in index_fields)))
+        update_schema_version(5)
+
+    if old_ver < 6:
+        # Add proxy test history and statistics tables.
+        db.create_tables([ProxyTest, ProxyStats], safe=True)
+        update_schema_version(6)
+
+    if old_ver < 7:
+        # Remove hash field unique index.
+        if has_index('proxy', 'proxy_hash'):
+            migrate(migrator.drop_index('proxy', 'proxy_hash'))
+        # Widen hash fields to 64 bits.
+        for table in ('proxy', 'proxytest', 'proxystats'):
+            db.execute_sql(
+                'ALTER TABLE `{}` '
+                'MODIFY COLUMN `hash` BIGINT UNSIGNED NOT NULL;'.format(table)
+            )
+        # Map test history and statistics to new hashes, same as
+        # Proxy.generate_hash() computed by MySQL.
+        for table in ('proxytest', 'proxystats'):
+            db.execute_sql(
+                "UPDATE IGNORE `{}` t JOIN `proxy` p ON t.`hash` = p.`hash` "
+                "SET t.`hash` = "
+                "(IF(p.`username` IS NULL OR p.`username` = '', 0, "
+                "CRC32(CONCAT(p.`username`, ':', IFNULL(p.`password`, ''))) "
+                "& 65535) << 48) | (p.`ip` << 16) | p.`port`;".format(table)
+            )
+        # Re-hash all proxies.
+        Proxy.rehash_all(checkpoint_file)
+        # Recreate hash field unique index.
+        migrate(migrator.add_index('proxy', ('hash',), True))
+        update_schema_version(7)
+
+    if old_ver < 8:
+        # Add country code field.
+        migrate(
+            migrator.add_column('proxy', 'country',
+                                Utf8mb4CharField(null=True, max_length=2))
+        )
+        update_schema_version(8)
+
+    if old_ver < 9:
+        # Add proxy source bitmask field and source statistics table.
+        migrate(
+            migrator.add_column('proxy', 'sources', UIntegerField(default=0))
+        )
+        db.create_tables([SourceStats], safe=True)
+        update_schema_version(9)
+
+    if old_ver < 10:
+        # Add indexes for purging expired and ignored country proxies.
+        for index_name, index_fields in PROXY_INDEXES[2:]:
+            if not has_index('proxy', index_name):
+                db.execute_sql('CREATE INDEX `{}` ON `proxy` ({});'.format(
+                    index_name,
+                    ', '.join('`{}`'.format(f) for f in index_fields)))
+        update_schema_version(10)
 
     # Always log that we're done.
     log.info('Schema upgrade complete.')
     return True
 
 
-def verify_database_schema():
+def verify_database_schema(checkpoint_file=None):
     if not Version.table_exists():
         log.info('Database schema is not created, initializing...')
         create_tables()
@@ -419,7 +1126,7 @@ def verify_database_schema():
         db_ver = Version.get(Version.key == 'schema_version').val
 
         if db_ver < db_schema_version:
-            if not migrate_database_schema(db_ver):
+            if not migrate_database_schema(db_ver, checkpoint_file):
                 log.error('Error migrating database schema.')
                 sys.exit(1)
 
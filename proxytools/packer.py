@@ -15,11 +15,21 @@
 # Merged changes from: https://github.com/beautify-web/js-beautify/pull/1368
 # Made various small cosmetic tweaks.
 # 2020-05-10: Python 3 adjustments
+# Precompiled regular expressions and cached deobfuscation results.
 #
 """Unpacker for Dean Edward's p.a.c.k.e.r"""
 
 import re
 
+from functools import lru_cache
+
+JUICERS = [
+    re.compile(r"}\('(.*)', *(\d+), *(\d+), *'(.*)'\.split\('\|'\), *(\d+), *(.*)\)\)", re.DOTALL), # noqa501
+    re.compile(r"}\('(.*)', *(\d+), *(\d+), *'(.*)'\.split\('\|'\)", re.DOTALL)]
+
+WORD = re.compile(r'\b\w+\b')
+STRINGS = re.compile(r'var *(_\w+)\=\["(.*?)"\];', re.DOTALL)
+
 
 class UnpackingError(Exception):
     """Badly packed source or general error. Argument is a
@@ -27,8 +37,11 @@ class UnpackingError(Exception):
     pass
 
 
+@lru_cache(maxsize=256)
 def deobfuscate(source):
-    """Detects whether `source` is obfuscated coded."""
+    """Detects whether `source` is obfuscated coded.
+    Results are cached by source content, same scripts are only unpacked
+    once."""
     source = source.replace(' ', '')
 
     if source.startswith('eval(function(p,r,o,x,y,s)'):
@@ -77,17 +90,14 @@ def unpack(source):
         word = match.group(0)
         return symtab[unbase(word)] or word
 
-    source = re.sub(r'\b\w+\b', lookup, payload)
+    source = WORD.sub(lookup, payload)
     return _replacestrings(source)
 
 
 def _filterargs(source):
     """Juice from a source file the four args needed by decoder."""
-    juicers = [(r"}\('(.*)', *(\d+), *(\d+), *'(.*)'\.split\('\|'\), *(\d+), *(.*)\)\)"), # noqa501
-               (r"}\('(.*)', *(\d+), *(\d+), *'(.*)'\.split\('\|'\)")]
-
-    for juicer in juicers:
-        args = re.search(juicer, source, re.DOTALL)
+    for juicer in JUICERS:
+        args = juicer.search(source)
         if args:
             a = args.groups()
             try:
@@ -102,16 +112,23 @@ def _filterargs(source):
 
 def _replacestrings(source):
     """Strip string lookup table (list) and replace values in source."""
-    match = re.search(r'var *(_\w+)\=\["(.*?)"\];', source, re.DOTALL)
+    match = STRINGS.search(source)
 
     if match:
         varname, strings = match.groups()
         startpoint = len(match.group(0))
         lookup = strings.split('","')
-        variable = '%s[%%d]' % varname
-        for index, value in enumerate(lookup):
-            source = source.replace(variable % index, '"%s"' % value)
-        return source[startpoint:]
+
+        def replace(match):
+            """Replace `varname[index]` with its string value."""
+            index = int(match.group(1))
+            if index < len(lookup):
+                return '"%s"' % lookup[index]
+            return match.group(0)
+
+        # Replace all references in a single pass.
+        variable = re.compile(re.escape(varname) + r'\[(\d+)\]')
+        return variable.sub(replace, source[startpoint:])
     return source
 
 
@@ -2,151 +2,525 @@
 # -*- coding: utf-8 -*-
 
 import logging
+import os
+import re
+import time
 
-from .utils import validate_ip
-from .models import ProxyProtocol, Proxy
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from queue import Empty, Full, Queue
+from threading import BoundedSemaphore, Event, Lock, Thread
+from timeit import default_timer
 
+from .models import ProxyProtocol, Proxy, SourceStats
+from .proxy_scrapper import ProxyScrapper, prune_cache
+
+from .scrappers import create_scrapper, scrapper_names
 from .scrappers.filereader import FileReader
-from .scrappers.freeproxylist import Freeproxylist
-from .scrappers.premproxy import Premproxy
-from .scrappers.idcloak import Idcloak
-from .scrappers.proxyserverlist24 import Proxyserverlist24
-from .scrappers.sockslist import Sockslist
-from .scrappers.socksproxy import Socksproxy
-from .scrappers.socksproxylist24 import Socksproxylist24
-from .scrappers.spysone import SpysHTTPS, SpysSOCKS
-from .scrappers.vipsocks24 import Vipsocks24
-
-from .scrappers.proxynova import ProxyNova
 
 log = logging.getLogger(__name__)
 
+# Proxy line grammar: [protocol://][username:password@]ip:port
+PROXY_LINE = re.compile(
+    r'\s*(?:([A-Za-z0-9]+)://)?'
+    r'(?:([^:@\s]*):([^@\s]*)@)?'
+    r'(\d{1,3})\.(\d{1,3})\.(\d{1,3})\.(\d{1,3}):(\d{1,5})\s*$')
+
+PROXY_PROTOCOLS = {
+    'http': ProxyProtocol.HTTP,
+    'socks4': ProxyProtocol.SOCKS4,
+    'socks5': ProxyProtocol.SOCKS5
+}
+
+
+# Single-pass proxy line parser.
+# Proxies are returned with packed integer IP and port and rejected
+# lines are counted by reason instead of being logged one by one.
+class ProxyLineParser(object):
+
+    def __init__(self, protocol=None):
+        self.protocol = protocol
+        self.rejects = {}
+
+    def parse(self, line, source=None):
+        proxy = self.__parse(line, source)
+        if proxy is not None:
+            proxy['hash'] = Proxy.generate_hash(proxy)
+
+        return proxy
+
+    # Parse lines and hash the resulting proxies in one pass.
+    def parse_many(self, lines, source=None):
+        parse = self.__parse
+        result = []
+        for line in lines:
+            proxy = parse(line, source)
+            if proxy is not None:
+                result.append(proxy)
+
+        return Proxy.generate_hashes(result)
+
+    def __parse(self, line, source):
+        match = PROXY_LINE.match(line)
+        if match is None:
+            return self.__reject('format')
+
+        scheme, username, password, a, b, c, d, port = match.groups()
+
+        protocol = self.protocol
+        if scheme:
+            protocol = PROXY_PROTOCOLS.get(scheme.lower())
+            if protocol is None:
+                return self.__reject('protocol')
+        elif protocol is None:
+            return self.__reject('no protocol')
+
+        a, b, c, d = int(a), int(b), int(c), int(d)
+        if a > 255 or b > 255 or c > 255 or d > 255:
+            return self.__reject('ip')
+
+        port = int(port)
+        if not 0 < port < 65536:
+            return self.__reject('port')
+
+        proxy = {
+            'hash': None,
+            'ip': (a << 24) | (b << 16) | (c << 8) | d,
+            'port': port,
+            'protocol': protocol,
+            'username': username,
+            'password': password,
+            'source': source
+        }
+        return proxy
+
+    # Log and reset reject counters.
+    def log_rejects(self, source):
+        if not self.rejects:
+            return
+
+        log.info('Rejected %d invalid proxies from %s: %s.',
+                 sum(self.rejects.values()), source,
+                 ', '.join('{} {}'.format(count, reason) for reason, count
+                           in sorted(self.rejects.items())))
+        self.rejects = {}
+
+    def __reject(self, reason):
+        self.rejects[reason] = self.rejects.get(reason, 0) + 1
+        return None
+
 
 class ProxyParser(object):
+    DEDUPE_WINDOW = 100000
+
+    scrapper_slots = None
 
-    def __init__(self, args, protocol=None):
+    # Insertion dates are unique per batch across all parsers.
+    insert_lock = Lock()
+    last_insert_date = datetime.min
+
+    def __init__(self, args, ip2location, protocol=None, proxy_store=None,
+                 known_proxies=None):
         self.debug = args.verbose
+        self.ip2location = ip2location
         self.download_path = args.download_path
         self.refresh_interval = args.proxy_refresh_interval
+        self.insert_batch = args.db_insert_batch
+        self.load_data_threshold = args.db_load_data_threshold
         self.protocol = protocol
-
-        # Configure proxy scrappers.
+        self.proxy_store = proxy_store
+        self.known_proxies = known_proxies
+
+        # Rolling batches must be large enough to use bulk loading.
+        self.batch_size = max(self.insert_batch, self.load_data_threshold)
+        self.run_stats = {}
+        # Scrapper threads by scrapper name, threads still running after
+        # the refresh deadline keep their scrapper out of later refreshes.
+        self.workers = {}
+        self.deadline = args.scrapper_deadline
+        self.cache_path = os.path.join(
+            args.download_path, ProxyScrapper.CACHE_DIR)
+        self.cache_days = args.scrapper_cache_days
+        self.cache_size = args.scrapper_cache_size
+        self.load_lock = Lock()
+
+        # Limit concurrent scrappers across all parsers.
+        if ProxyParser.scrapper_slots is None:
+            ProxyParser.scrapper_slots = BoundedSemaphore(
+                args.scrapper_max_concurrency)
+
+        # Configure proxy scrappers, registry scrappers in `pending` are
+        # created on first refresh.
+        self.args = args
         self.scrappers = []
+        self.pending = []
 
-    def __parse_proxylist(self, proxylist):
-        result = {}
+    # Run scrapper and push parsed proxies into the queue, tagged with the
+    # scrapper read position. The scrapper name and its run statistics
+    # are sent as the last item once it finishes.
+    def __scrap_worker(self, scrapper, queue, cancel):
+        line_parser = ProxyLineParser(self.protocol)
+        stats = {'scrapped': 0, 'fetch_time': 0.0, 'failed': False}
 
-        for proxy in proxylist:
-            # Strip spaces from proxy string.
-            proxy = proxy.strip()
-            if len(proxy) < 9:
-                log.debug('Invalid proxy address: %s', proxy)
-                continue
+        with self.scrapper_slots:
+            # Refresh deadline was reached while waiting for a slot.
+            if cancel.is_set():
+                return
 
-            parsed = {
-                'hash': None,
-                'ip': None,
-                'port': None,
-                'protocol': self.protocol,
-                'username': None,
-                'password': None
-            }
-
-            # Check and separate protocol from proxy address.
-            if '://' in proxy:
-                pieces = proxy.split('://')
-                proxy = pieces[1]
-                if pieces[0] == 'http':
-                    parsed['protocol'] = ProxyProtocol.HTTP
-                elif pieces[0] == 'socks4':
-                    parsed['protocol'] = ProxyProtocol.SOCKS4
-                elif pieces[0] == 'socks5':
-                    parsed['protocol'] = ProxyProtocol.SOCKS5
-                else:
-                    log.error('Unknown proxy protocol in: %s', proxy)
-                    continue
+            timer = default_timer()
+            try:
+                for proxy in scrapper.scrap():
+                    stats['scrapped'] += 1
+                    parsed = line_parser.parse(proxy, scrapper.name)
+                    if parsed is None:
+                        continue
+                    parsed['sources'] = scrapper.source_mask
+                    parsed['position'] = scrapper.position
+                    if not self.__put(queue, parsed, cancel):
+                        break
+            except Exception as e:
+                log.exception('%s proxy scrapper failed: %s',
+                              type(scrapper).__name__, e)
+                stats['failed'] = True
+
+            stats['fetch_time'] = default_timer() - timer
+
+        line_parser.log_rejects(scrapper.name)
+        scrapper.log_cache_stats()
+        self.__put(queue, (scrapper.name, stats), cancel)
 
-            if parsed['protocol'] is None:
-                log.error('Proxy protocol is not set for: %s', proxy)
+    # Blocking put that gives up once the refresh is cancelled.
+    def __put(self, queue, item, cancel):
+        while not cancel.is_set():
+            try:
+                queue.put(item, timeout=1)
+                return True
+            except Full:
                 continue
 
-            # Check and separate authentication from proxy address.
-            if '@' in proxy:
-                pieces = proxy.split('@')
-                if ':' not in pieces[0]:
-                    log.error('Unknown authentication format in: %s', proxy)
+        return False
+
+    # Stream proxies from all scrappers, skipping recently seen proxies.
+    # Scrappers run concurrently and results are consumed as they arrive
+    # until all scrappers finish or the refresh deadline is reached.
+    # Only the last DEDUPE_WINDOW hashes are remembered, duplicates that
+    # fall outside the window are ignored by the database insert.
+    # Duplicates found by another source are streamed again so their
+    # source is recorded.
+    def __stream_proxies(self, scrappers):
+        seen = OrderedDict()
+        queue = Queue(maxsize=self.batch_size)
+        cancel = Event()
+
+        for scrapper in scrappers:
+            t = Thread(name='scrapper-' + scrapper.name,
+                       target=self.__scrap_worker,
+                       args=(scrapper, queue, cancel))
+            t.daemon = True
+            t.start()
+            self.workers[scrapper.name] = t
+
+        running = len(scrappers)
+        deadline = default_timer() + self.deadline
+        try:
+            while running:
+                timeout = deadline - default_timer()
+                if timeout <= 0:
+                    log.warning('%s refresh deadline reached, %d scrappers '
+                                'are still running.',
+                                type(self).__name__, running)
+                    break
+
+                try:
+                    parsed = queue.get(timeout=timeout)
+                except Empty:
                     continue
-                auth = pieces[0].split(':')
-
-                parsed['username'] = auth[0]
-                parsed['password'] = auth[1]
-                proxy = pieces[1]
 
-            # Check and separate IP and port from proxy address.
-            if ':' not in proxy:
-                log.error('Proxy address port not specified in: %s', proxy)
-                continue
+                if not isinstance(parsed, dict):
+                    # Everything this scrapper found has been streamed.
+                    name, stats = parsed
+                    self.run_stats[name].update(stats)
+                    self.run_stats[name]['finished'] = True
+                    running -= 1
+                    continue
 
-            pieces = proxy.split(':')
+                self.run_stats[parsed['source']]['parsed'] += 1
+                sources = seen.get(parsed['hash'])
+                if sources is not None:
+                    if sources | parsed['sources'] == sources:
+                        continue
+                    seen[parsed['hash']] = sources | parsed['sources']
+                    yield parsed
+                    continue
 
-            if not validate_ip(pieces[0]):
-                log.error('IP address is not valid in: %s', proxy)
+                seen[parsed['hash']] = parsed['sources']
+                if len(seen) > self.DEDUPE_WINDOW:
+                    seen.popitem(last=False)
+
+                yield parsed
+        finally:
+            cancel.set()
+
+    # Geolocate proxies in one batch and drop ignored countries.
+    def __filter_countries(self, proxylist):
+        result = []
+        dropped = {}
+        ignore_codes = self.ip2location.ignore_codes
+
+        countries = self.ip2location.lookup_country_codes(
+            [proxy['ip'] for proxy in proxylist])
+        for proxy, country in zip(proxylist, countries):
+            if country in ignore_codes:
+                dropped[proxy['source']] = dropped.get(proxy['source'], 0) + 1
                 continue
 
-            parsed['ip'] = pieces[0]
-            parsed['port'] = pieces[1]
-            parsed['hash'] = Proxy.generate_hash(parsed)
+            proxy['country'] = country
+            result.append(proxy)
 
-            result[parsed['hash']] = parsed
+        for source, count in sorted(dropped.items()):
+            log.info('Dropped %d proxies from %s in ignored countries.',
+                     count, source)
 
-        log.info('Successfully parsed %d proxies.', len(result))
         return result
 
-    def load_proxylist(self):
-        if not self.scrappers:
-            return
-
-        proxylist = set()
-
-        for scrapper in self.scrappers:
+    # Filter and insert a batch of parsed proxies.
+    def __process_batch(self, batch):
+        proxylist = batch
+        known = []
+        if self.known_proxies is not None:
+            # Drop proxies already in database before running any SQL.
+            proxylist = self.known_proxies.filter(proxylist)
+            if len(proxylist) < len(batch):
+                new = set(proxy['hash'] for proxy in proxylist)
+                known = [proxy for proxy in batch if proxy['hash'] not in new]
+
+        inserted = []
+        if proxylist:
+            proxylist = self.__filter_countries(proxylist)
+            inserted = self.insert_proxylist(proxylist)
+
+        if len(inserted) < len(proxylist):
+            # Duplicates were ignored by the database insert.
+            new = set(proxy['hash'] for proxy in inserted)
+            known.extend(proxy for proxy in proxylist
+                         if proxy['hash'] not in new)
+
+        # Record new sources of proxies already in database.
+        if known:
+            Proxy.add_sources(known)
+            if self.proxy_store is not None:
+                self.proxy_store.add_sources(known)
+
+        for proxy in inserted:
+            self.run_stats[proxy['source']]['new'] += 1
+
+        if self.known_proxies is not None:
+            self.known_proxies.add([proxy['hash'] for proxy in inserted])
+
+        if self.proxy_store is not None:
+            self.proxy_store.add(inserted)
+
+        return len(batch), len(inserted)
+
+    # Check if any scrapper is due for a refresh.
+    def is_due(self):
+        return bool(self.pending) or any(
+            scrapper.is_due() for scrapper in self.scrappers)
+
+    # Create pending scrappers from registry.
+    def __create_scrappers(self):
+        while self.pending:
+            name = self.pending.pop(0)
             try:
-                proxylist.update(scrapper.scrap())
+                self.scrappers.append(create_scrapper(name, self.args))
             except Exception as e:
-                log.exception('%s proxy scrapper failed: %s',
-                              type(scrapper).__name__, e)
+                log.exception('Failed to create proxy scrapper %s: %s',
+                              name, e)
+
+    # Check if scrapper is still running from a previous refresh.
+    def __is_running(self, scrapper):
+        worker = self.workers.get(scrapper.name)
+        if worker is None:
+            return False
+        if worker.is_alive():
+            return True
+
+        del self.workers[scrapper.name]
+        return False
+
+    # Load proxylists from scrappers due for a refresh, or from all
+    # scrappers if `force` is set.
+    def load_proxylist(self, force=False):
+        with self.load_lock:
+            self.__create_scrappers()
+            scrappers = []
+            for scrapper in self.scrappers:
+                if not force and not scrapper.is_due():
+                    continue
+                if self.__is_running(scrapper):
+                    log.debug('%s proxy scrapper is still running from '
+                              'last refresh, skipping it.',
+                              type(scrapper).__name__)
+                    continue
+                scrappers.append(scrapper)
+
+            if not scrappers:
+                return
+
+            self.run_stats = {
+                scrapper.name: {'scrapped': 0, 'parsed': 0, 'new': 0,
+                                'fetch_time': 0.0, 'failed': False,
+                                'finished': False}
+                for scrapper in scrappers}
+
+            self.__load_proxylist(scrappers)
+
+            source_stats = SourceStats.get_stats()
+            for scrapper in scrappers:
+                stats = self.run_stats[scrapper.name]
+                scrapper.record_run(stats['parsed'], stats['new'],
+                                    stats['fetch_time'], stats['failed'])
+                scrapper.log_stats(source_stats.get(scrapper.SOURCE_ID))
+
+            prune_cache(self.cache_path, self.cache_days, self.cache_size)
+
+    def __load_proxylist(self, scrappers):
+        parsed = 0
+        inserted = 0
+        batch = {}
+
+        # Insert proxies in rolling batches while scrappers are running.
+        for proxy in self.__stream_proxies(scrappers):
+            pending = batch.get(proxy['hash'])
+            if pending is not None:
+                # Proxy found by another source before batch was inserted.
+                pending['sources'] |= proxy['sources']
+                continue
+
+            batch[proxy['hash']] = proxy
+            if len(batch) >= self.batch_size:
+                total, count = self.__process_batch(list(batch.values()))
+                self.__commit_positions(scrappers, batch.values())
+                parsed += total
+                inserted += count
+                batch = {}
+
+        if batch:
+            total, count = self.__process_batch(list(batch.values()))
+            self.__commit_positions(scrappers, batch.values())
+            parsed += total
+            inserted += count
+
+        # Every proxy streamed has been stored, commit read positions of
+        # scrappers that finished (lines skipped at the end included).
+        for scrapper in scrappers:
+            if (self.run_stats[scrapper.name]['finished'] and
+                    scrapper.position is not None):
+                scrapper.commit(scrapper.position)
+
+        scrapped = sum(s['scrapped'] for s in self.run_stats.values())
+        log.info('%s scrapped a total of %d proxies, %d parsed and %d new.',
+                 type(self).__name__, scrapped, parsed, inserted)
+
+    # Commit scrapper read positions up to the last proxy of a stored batch.
+    # Proxies from each scrapper are streamed in order.
+    def __commit_positions(self, scrappers, batch):
+        positions = {}
+        for proxy in batch:
+            if proxy['position'] is not None:
+                positions[proxy['source']] = max(
+                    proxy['position'], positions.get(proxy['source'], 0))
+
+        for scrapper in scrappers:
+            if scrapper.name in positions:
+                scrapper.commit(positions[scrapper.name])
+
+    # Insert proxies into the database and return those actually inserted.
+    # The batch gets its own insertion date (without fractional seconds, as
+    # stored by MySQL) to tell new rows from duplicates when the row count
+    # shows some proxies were skipped.
+    def insert_proxylist(self, proxylist):
+        with ProxyParser.insert_lock:
+            insert_date = max(datetime.utcnow().replace(microsecond=0),
+                              ProxyParser.last_insert_date +
+                              timedelta(seconds=1))
+            ProxyParser.last_insert_date = insert_date
+
+        for proxy in proxylist:
+            proxy['insert_date'] = insert_date
+
+        count = None
+        if (self.load_data_threshold and
+                len(proxylist) >= self.load_data_threshold):
+            filename = os.path.join(
+                self.download_path,
+                '{}.tsv'.format(type(self).__name__.lower()))
+            count = Proxy.load_data(proxylist, filename)
 
-        log.info('%s scrapped a total of %d proxies.',
-                 type(self).__name__, len(proxylist))
-        proxylist = self.__parse_proxylist(proxylist)
-        Proxy.insert_new(list(proxylist.values()))
+        # Fallback to multi-row inserts if bulk loading is disabled or failed.
+        if count is None:
+            count = Proxy.insert_new(proxylist, self.insert_batch)
+
+        if count >= len(proxylist):
+            return proxylist
+        if not count:
+            return []
+
+        inserted = Proxy.get_inserted(
+            [proxy['hash'] for proxy in proxylist], insert_date)
+        return [proxy for proxy in proxylist if proxy['hash'] in inserted]
 
 
 class MixedParser(ProxyParser):
 
-    def __init__(self, args):
-        super(MixedParser, self).__init__(args)
+    def __init__(self, args, ip2location, proxy_store=None,
+                 known_proxies=None):
+        super(MixedParser, self).__init__(
+            args, ip2location, None, proxy_store, known_proxies)
+        self.watch_interval = args.proxy_file_watch
+
         if args.proxy_file:
-            self.scrappers.append(FileReader(args))
+            file_reader = FileReader(args)
+            self.scrappers.append(file_reader)
+
+            if self.watch_interval > 0:
+                watcher = Thread(name='file-watcher',
+                                 target=self.__watch_worker,
+                                 args=(file_reader,))
+                watcher.daemon = True
+                watcher.start()
+
+    # Ingest lines appended to proxy file without waiting for refresh.
+    def __watch_worker(self, file_reader):
+        while True:
+            time.sleep(self.watch_interval)
+            try:
+                if file_reader.has_changed():
+                    self.load_proxylist(force=True)
+            except Exception as e:
+                log.exception('Exception in proxy file watcher: %s', e)
 
 
 class HTTPParser(ProxyParser):
 
-    def __init__(self, args):
-        super(HTTPParser, self).__init__(args, ProxyProtocol.HTTP)
-        self.scrappers.append(Freeproxylist(args))
-        self.scrappers.append(Premproxy(args))
-        self.scrappers.append(Proxyserverlist24(args))
-        self.scrappers.append(SpysHTTPS(args))
-        self.scrappers.append(ProxyNova(args))
-        # self.scrappers.append(Idcloak(args))  # OFFLINE
+    def __init__(self, args, ip2location, proxy_store=None,
+                 known_proxies=None):
+        super(HTTPParser, self).__init__(
+            args, ip2location, ProxyProtocol.HTTP, proxy_store, known_proxies)
+        if args.proxy_scrap:
+            self.pending = scrapper_names(
+                ProxyProtocol.HTTP, args.scrapper_enable,
+                args.scrapper_disable)
 
 
 class SOCKSParser(ProxyParser):
 
-    def __init__(self, args):
-        super(SOCKSParser, self).__init__(args, ProxyProtocol.SOCKS5)
-        self.scrappers.append(Sockslist(args))
-        self.scrappers.append(Socksproxy(args))
-        self.scrappers.append(SpysSOCKS(args))
-        self.scrappers.append(Vipsocks24(args))
-        # self.scrappers.append(Socksproxylist24(args))  # Duplicate of VipSocks24
+    def __init__(self, args, ip2location, proxy_store=None,
+                 known_proxies=None):
+        super(SOCKSParser, self).__init__(
+            args, ip2location, ProxyProtocol.SOCKS5, proxy_store,
+            known_proxies)
+        if args.proxy_scrap:
+            self.pending = scrapper_names(
+                ProxyProtocol.SOCKS5, args.scrapper_enable,
+                args.scrapper_disable)
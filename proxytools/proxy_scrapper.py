@@ -1,15 +1,65 @@
 #!/usr/bin/python
 # -*- coding: utf-8 -*-
 
+import hashlib
+import json
 import logging
+import os
 import requests
+import time
+
+from importlib.util import find_spec
+from threading import Lock
+from timeit import default_timer
+from urllib.parse import urlencode, urlparse
 from urllib3.util.retry import Retry
 from requests.adapters import HTTPAdapter
 
+from .download import Download
 from .utils import export_file
 
 log = logging.getLogger(__name__)
 
+# Use lxml parser if it is installed, it is much faster than html.parser.
+# BeautifulSoup and lxml are only imported when a webpage is parsed.
+HTML_PARSER = 'lxml' if find_spec('lxml') else 'html.parser'
+
+
+# Delete page cache files not used for `max_days` and then the least
+# recently used files until the cache fits in `max_size` MB.
+# Cache files are touched whenever their webpage is requested.
+def prune_cache(cache_path, max_days, max_size):
+    entries = []
+    try:
+        for entry in os.scandir(cache_path):
+            if entry.is_file():
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+    except OSError as e:
+        log.warning('Unable to list page cache "%s": %s', cache_path, e)
+        return 0
+
+    entries.sort()
+    min_mtime = time.time() - max_days * 86400
+    size = sum(entry[1] for entry in entries)
+    max_size *= 1024 * 1024
+
+    count = 0
+    for mtime, file_size, path in entries:
+        if mtime >= min_mtime and size <= max_size:
+            break
+        try:
+            os.remove(path)
+            count += 1
+        except OSError:
+            pass
+        size -= file_size
+
+    if count:
+        log.info('Pruned %d webpages from page cache, %.1f MB left.',
+                 count, size / 1024.0 / 1024.0)
+    return count
+
 
 class ProxyScrapper(object):
     REFERER = 'http://google.com'
@@ -22,13 +72,56 @@ class ProxyScrapper(object):
         'Referer': REFERER
     }
     STATUS_FORCELIST = [500, 502, 503, 504]
+    CACHE_DIR = 'cache'
+    MAX_DOWNLOAD_SIZE = 32 * 1024 * 1024
+    # Stable bit index identifying proxies found by this scrapper (0 - 31).
+    SOURCE_ID = None
+
+    # Adaptive refresh interval limits, relative to --proxy-refresh-interval.
+    MIN_REFRESH_FACTOR = 0.25
+    MAX_REFRESH_FACTOR = 8
+    # Warn about sources without new proxies for this many runs.
+    STALE_RUNS_WARNING = 5
+
+    # Politeness state shared by all scrappers: one request at a time
+    # per host and a minimum delay between consecutive requests.
+    hosts_lock = Lock()
+    host_locks = {}
+    host_timers = {}
 
     def __init__(self, args, name):
         self.timeout = args.scrapper_timeout
+        self.host_delay = args.scrapper_host_delay
         self.proxy = args.scrapper_proxy
         self.ignore_country = args.proxy_ignore_country
         self.debug = args.verbose
         self.download_path = args.download_path
+        self.source_mask = 0
+        if self.SOURCE_ID is not None:
+            self.source_mask = 1 << self.SOURCE_ID
+        self.cache_path = os.path.join(args.download_path, self.CACHE_DIR)
+        if not os.path.isdir(self.cache_path):
+            os.makedirs(self.cache_path, exist_ok=True)
+
+        self.cache_requests = 0
+        self.cache_hits = 0
+        self.cache_replays = 0
+
+        # Source statistics and refresh scheduling.
+        self.refresh_interval = args.proxy_refresh_interval
+        self.min_refresh = self.refresh_interval * self.MIN_REFRESH_FACTOR
+        self.max_refresh = self.refresh_interval * self.MAX_REFRESH_FACTOR
+        self.next_refresh = 0
+        self.runs = 0
+        self.failures = 0
+        self.stale_runs = 0
+        self.total_parsed = 0
+        self.total_new = 0
+        self.total_fetch_time = 0.0
+
+        # Resumable scrappers set the read position after the last proxy
+        # yielded, it is committed once proxies up to there are stored.
+        self.position = None
 
         self.name = name
         log.info('Initialized proxy scrapper: %s.', name)
@@ -45,8 +138,67 @@ class ProxyScrapper(object):
         self.session.mount('http://', HTTPAdapter(max_retries=self.retries))
         self.session.mount('https://', HTTPAdapter(max_retries=self.retries))
 
-    def request_url(self, url, referer=None, post={}):
+    # Wait for our turn to send a request to the URL host.
+    def acquire_host(self, url):
+        host = urlparse(url).netloc
+        with ProxyScrapper.hosts_lock:
+            lock = ProxyScrapper.host_locks.get(host)
+            if lock is None:
+                lock = ProxyScrapper.host_locks[host] = Lock()
+
+        lock.acquire()
+        wait = (ProxyScrapper.host_timers.get(host, 0) + self.host_delay -
+                default_timer())
+        if wait > 0:
+            time.sleep(wait)
+
+        return host
+
+    def release_host(self, host):
+        ProxyScrapper.host_timers[host] = default_timer()
+        ProxyScrapper.host_locks[host].release()
+
+    def cache_file(self, url, post={}):
+        key = url
+        if post:
+            key += '?' + urlencode(sorted(post.items()))
+        key = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_path, key + '.json')
+
+    def load_cache(self, filename):
+        try:
+            with open(filename, 'r', encoding='utf-8') as fd:
+                return json.load(fd)
+        except (IOError, ValueError):
+            return {}
+
+    def save_cache(self, filename, entry):
+        temp_file = filename + '.tmp'
+        try:
+            with open(temp_file, 'w', encoding='utf-8') as fd:
+                json.dump(entry, fd)
+            os.replace(temp_file, filename)
+        except (IOError, OSError) as e:
+            log.warning('Unable to save page cache "%s": %s', filename, e)
+
+    # Mark cache entry as recently used.
+    def touch_cache(self, filename):
+        try:
+            os.utime(filename)
+        except OSError as e:
+            log.debug('Unable to touch page cache "%s": %s', filename, e)
+
+    # Request webpage using cached validators and content hash.
+    # Returns webpage content (None if request failed) and cache entry,
+    # entry['unchanged'] is set when content is identical to last fetch.
+    def fetch_webpage(self, url, referer=None, post={}):
+        filename = self.cache_file(url, post)
+        entry = self.load_cache(filename)
         content = None
+        unchanged = False
+        self.cache_requests += 1
+
+        host = self.acquire_host(url)
         try:
             # Setup request headers.
             headers = self.CLIENT_HEADERS.copy()
@@ -62,23 +214,145 @@ class ProxyScrapper(object):
                     headers=headers,
                     data=post)
             else:
+                # Conditional request if we have a cached copy.
+                if entry.get('content') is not None:
+                    if entry.get('etag'):
+                        headers['If-None-Match'] = entry['etag']
+                    if entry.get('last_modified'):
+                        headers['If-Modified-Since'] = entry['last_modified']
+
                 response = self.session.get(
                     url,
                     proxies={'http': self.proxy, 'https': self.proxy},
                     timeout=self.timeout,
                     headers=headers)
 
-            if response.status_code == 200:
+            if response.status_code == 304 and 'content' in entry:
+                content = entry['content']
+                unchanged = True
+                self.touch_cache(filename)
+            elif response.status_code == 200:
                 content = response.text
+                content_hash = hashlib.sha1(
+                    content.encode('utf-8')).hexdigest()
+                unchanged = content_hash == entry.get('content_hash')
+                if not unchanged:
+                    entry = {
+                        'url': url,
+                        'content_hash': content_hash,
+                        'content': content}
+
+                entry['etag'] = response.headers.get('ETag')
+                entry['last_modified'] = response.headers.get('Last-Modified')
+                self.save_cache(filename, entry)
 
             response.close()
         except Exception as e:
             log.exception('Failed to request URL "%s": %s', url, e)
+        finally:
+            self.release_host(host)
+
+        if unchanged:
+            self.cache_hits += 1
 
+        entry['unchanged'] = unchanged
+        return content, entry
+
+    def request_url(self, url, referer=None, post={}):
+        content, entry = self.fetch_webpage(url, referer, post)
         return content
 
-    def download_file(self, url, filename, referer=None):
-        result = False
+    # Request webpage and extract proxies using `parse` function.
+    # Parsing is skipped and the previous result replayed when the webpage
+    # is identical to the last fetch. Returns None if request failed.
+    def scrap_url(self, url, parse, referer=None, post={}):
+        content, entry = self.fetch_webpage(url, referer, post)
+        if content is None:
+            return None
+
+        if entry['unchanged'] and 'proxylist' in entry:
+            self.cache_replays += 1
+            log.debug('Webpage unchanged, replaying %d proxies from: %s',
+                      len(entry['proxylist']), url)
+            return entry['proxylist']
+
+        log.info('Parsing proxylist from webpage: %s', url)
+        proxylist = parse(content)
+
+        entry.pop('unchanged')
+        entry['proxylist'] = proxylist
+        self.save_cache(self.cache_file(url, post), entry)
+        return proxylist
+
+    # Log and reset page cache statistics.
+    def log_cache_stats(self):
+        if not self.cache_requests:
+            return
+
+        log.info('Page cache for %s: %d of %d webpages unchanged (%.0f%%), '
+                 '%d parses skipped.', self.name, self.cache_hits,
+                 self.cache_requests,
+                 100.0 * self.cache_hits / self.cache_requests,
+                 self.cache_replays)
+        self.cache_requests = 0
+        self.cache_hits = 0
+        self.cache_replays = 0
+
+    def is_due(self):
+        return default_timer() >= self.next_refresh
+
+    # Update source statistics with the results of a scrap run and
+    # schedule next refresh: sources contributing new proxies are polled
+    # more often, stale or failing sources back off.
+    def record_run(self, parsed, new, fetch_time, failed=False):
+        self.runs += 1
+        self.total_parsed += parsed
+        self.total_new += new
+        self.total_fetch_time += fetch_time
+
+        if failed:
+            self.failures += 1
+
+        if new > 0:
+            self.stale_runs = 0
+            self.refresh_interval = max(self.min_refresh,
+                                        self.refresh_interval / 2)
+        else:
+            self.stale_runs += 1
+            self.refresh_interval = min(self.max_refresh,
+                                        self.refresh_interval * 2)
+
+        self.next_refresh = default_timer() + self.refresh_interval
+
+    # Log source statistics, `source_stats` are the aggregated first test
+    # results of proxies found by this source.
+    def log_stats(self, source_stats=None):
+        duplicates = 0
+        if self.total_parsed:
+            duplicates = 100.0 * (1 - self.total_new / self.total_parsed)
+
+        log.info('Source %s: %d runs (%d failed), %d new out of %d parsed '
+                 'proxies (%.0f%% duplicates), %.1fs fetch time per run, '
+                 'next refresh in %d minutes.', self.name, self.runs,
+                 self.failures, self.total_new, self.total_parsed,
+                 duplicates, self.total_fetch_time / max(self.runs, 1),
+                 self.refresh_interval / 60)
+
+        if source_stats and source_stats['tests']:
+            log.info('Source %s: %d of %d proxies passed their first test '
+                     '(%.1f%%).', self.name, source_stats['passes'],
+                     source_stats['tests'],
+                     100.0 * source_stats['passes'] / source_stats['tests'])
+
+        if self.stale_runs >= self.STALE_RUNS_WARNING:
+            log.warning('Source %s has not contributed new proxies in the '
+                        'last %d runs.', self.name, self.stale_runs)
+
+    # Stream download into memory, spilling to disk if it is large.
+    # Returns a Download that must be closed or None if request failed.
+    def download(self, url, referer=None, checksum=None):
+        result = None
+        host = self.acquire_host(url)
         try:
             # Setup request headers.
             if referer:
@@ -91,19 +365,44 @@ class ProxyScrapper(object):
                 url,
                 proxies={'http': self.proxy, 'https': self.proxy},
                 timeout=self.timeout,
-                headers=headers)
+                headers=headers,
+                stream=True)
+            response.raise_for_status()
 
-            with open(filename, 'wb') as fd:
-                for chunk in response.iter_content(chunk_size=128):
-                    fd.write(chunk)
-                result = True
-
-            response.close()
+            result = Download(self.MAX_DOWNLOAD_SIZE, checksum)
+            result.fetch(response)
         except Exception as e:
             log.exception('Failed to download file "%s": %s.', url, e)
+            if result:
+                result.close()
+                result = None
+        finally:
+            self.release_host(host)
 
         return result
 
+    def download_file(self, url, filename, referer=None):
+        download = self.download(url, referer)
+        if download is None:
+            return False
+
+        with download:
+            download.extract(filename)
+
+        return True
+
+    # Parse HTML with the fastest parser available.
+    # Parsing can be restricted to elements matching `name`, `attrs` and
+    # keyword filters (same as find_all) to skip the rest of the webpage.
+    def make_soup(self, html, name=None, attrs={}, **kwargs):
+        from bs4 import BeautifulSoup, SoupStrainer
+
+        parse_only = None
+        if name or attrs or kwargs:
+            parse_only = SoupStrainer(name, attrs, **kwargs)
+
+        return BeautifulSoup(html, HTML_PARSER, parse_only=parse_only)
+
     def export_webpage(self, soup, filename):
         content = soup.prettify()  # .encode('utf8')
         filename = '{}/{}'.format(self.download_path, filename)
@@ -119,7 +418,12 @@ class ProxyScrapper(object):
                 break
         return valid
 
+    # Save read position once proxies up to `position` are stored.
+    # Resumable scrappers override this method.
+    def commit(self, position):
+        pass
+
     # Sub-classes are required to implement this method.
-    # Method implementations must return found proxylist.
+    # Method implementations must be generators yielding found proxies.
     def scrap(self):
         raise NotImplementedError('Must override scrap() method.')
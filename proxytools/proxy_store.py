@@ -0,0 +1,423 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import heapq
+import logging
+import time
+
+from array import array
+from datetime import datetime, timedelta
+from threading import Event, Lock, Thread
+
+from .models import db_step, Proxy, ProxyStatus, SourceStats
+from .utils import int2ip
+
+log = logging.getLogger(__name__)
+
+EPOCH = datetime(1970, 1, 1)
+NO_LATENCY = 0xFFFFFFFF
+
+
+def to_timestamp(date):
+    if date is None:
+        return 0.0
+    return (date - EPOCH).total_seconds()
+
+
+def from_timestamp(timestamp):
+    if not timestamp:
+        return None
+    return EPOCH + timedelta(seconds=timestamp)
+
+
+# Pack two letter country codes into 16 bit integers.
+def pack_country(country):
+    if not country:
+        return 0
+    return (ord(country[0]) << 8) | ord(country[1])
+
+
+def unpack_country(country):
+    if not country:
+        return None
+    return chr(country >> 8) + chr(country & 0xFF)
+
+
+# In-memory columnar copy of the proxy table.
+# Each proxy occupies one slot across all column arrays and slots are
+# indexed by proxy hash. Scheduling and ranking work directly on the
+# columns while modified slots are flushed to the database on a timer.
+class ProxyStore(object):
+    # Rebuild scheduling heaps once they hold this many entries per proxy,
+    # updates leave stale entries behind that are only dropped when popped.
+    COMPACT_FACTOR = 2
+
+    def __init__(self, args):
+        self.flush_interval = args.db_flush_interval
+        self.lock = Lock()
+        self.running = Event()
+
+        self.index = {}
+        self.free_slots = []
+        self.dirty = set()
+        self.credentials = {}
+        # Slots of proxies that passed all tests on their last scan.
+        self.valid = set()
+        # Min-heap of scheduling entries: (scan_date, insert_date, slot).
+        self.schedule = []
+        # Min-heap of proxies never tested, ordered by source priority:
+        # (-score, insert_date, slot).
+        self.first_schedule = []
+        self.priorities = []
+
+        self.hash = array('Q')
+        self.ip = array('L')
+        self.port = array('H')
+        self.protocol = array('B')
+        self.insert_date = array('d')
+        self.scan_date = array('d')
+        self.latency = array('L')
+        self.fail_count = array('H')
+        self.anonymous = array('B')
+        self.niantic = array('B')
+        self.ptc_login = array('B')
+        self.ptc_signup = array('B')
+        self.country = array('H')
+        self.sources = array('L')
+
+    def __len__(self):
+        return len(self.index)
+
+    def load(self):
+        log.info('Loading proxies from database into memory store.')
+        count = 0
+        last_hash = -1
+        while True:
+            query = (Proxy
+                     .select()
+                     .where(Proxy.hash > last_hash)
+                     .order_by(Proxy.hash.asc())
+                     .limit(db_step * 40)
+                     .dicts())
+            rows = list(query)
+            if not rows:
+                break
+
+            with self.lock:
+                for row in rows:
+                    self.__store(row)
+            count += len(rows)
+            last_hash = rows[-1]['hash']
+
+        with self.lock:
+            self.dirty.clear()
+        log.info('Loaded %d proxies into memory store.', count)
+
+    def launch(self):
+        flusher = Thread(name='proxy-store', target=self.__flush_worker)
+        flusher.daemon = True
+        flusher.start()
+
+    def add(self, proxylist):
+        count = 0
+        with self.lock:
+            for proxy in proxylist:
+                if proxy['hash'] in self.index:
+                    continue
+                self.__store(Proxy.db_format(proxy))
+                count += 1
+
+        log.debug('Added %d new proxies to memory store.', count)
+        return count
+
+    def update(self, proxy):
+        with self.lock:
+            slot = self.__store(proxy)
+            self.dirty.add(slot)
+
+    # Merge source bitmasks of proxies already stored.
+    def add_sources(self, proxylist):
+        with self.lock:
+            for proxy in proxylist:
+                slot = self.index.get(proxy['hash'])
+                if slot is not None:
+                    self.sources[slot] |= proxy.get('sources', 0)
+
+    # Re-order proxies never tested with new source priorities.
+    def set_priorities(self, priorities):
+        with self.lock:
+            if priorities == self.priorities:
+                return
+
+            self.priorities = priorities
+            self.first_schedule = [
+                (-SourceStats.priority(self.sources[slot], priorities),
+                 self.insert_date[slot], slot)
+                for slot in self.index.values() if not self.scan_date[slot]]
+            heapq.heapify(self.first_schedule)
+
+    # Proxies never tested come first, ordered by source priority.
+    def get_scan(self, limit=1000, exclude=[], age_secs=3600, protocol=None,
+                 ignore_countries=None):
+        result = []
+        skipped = []
+        min_age = to_timestamp(datetime.utcnow()) - age_secs
+        exclude = set(exclude)
+        ignore = set(pack_country(c) for c in ignore_countries or [])
+
+        with self.lock:
+            schedule = self.first_schedule
+            while schedule and len(result) < limit:
+                entry = heapq.heappop(schedule)
+                score, insert_date, slot = entry
+                # Skip entries of tested, updated or deleted proxies.
+                if (self.hash[slot] not in self.index or
+                        self.scan_date[slot] or
+                        self.insert_date[slot] != insert_date):
+                    continue
+                if self.country[slot] in ignore:
+                    continue
+
+                skipped.append(entry)
+                if (self.hash[slot] in exclude or
+                        (protocol is not None and
+                         self.protocol[slot] != protocol)):
+                    continue
+
+                exclude.add(self.hash[slot])
+                result.append(self.__db_row(slot))
+
+            for entry in skipped:
+                heapq.heappush(schedule, entry)
+
+            skipped = []
+            schedule = self.schedule
+            while schedule and len(result) < limit:
+                entry = schedule[0]
+                if entry[0] >= min_age:
+                    break
+
+                heapq.heappop(schedule)
+                scan_date, insert_date, slot = entry
+                # Skip entries invalidated by later updates or deletes.
+                if (self.hash[slot] not in self.index or
+                        self.scan_date[slot] != scan_date or
+                        self.insert_date[slot] != insert_date):
+                    continue
+                if self.fail_count[slot] >= 5:
+                    continue
+                if self.country[slot] in ignore:
+                    continue
+                if (self.hash[slot] in exclude or
+                        (protocol is not None and
+                         self.protocol[slot] != protocol)):
+                    skipped.append(entry)
+                    continue
+
+                # Re-schedule entry, it is only removed by an update.
+                skipped.append(entry)
+                result.append(self.__db_row(slot))
+
+            for entry in skipped:
+                heapq.heappush(schedule, entry)
+
+        return [self.__format(proxy) for proxy in result]
+
+    # Rank valid proxies on a snapshot of their columns, the store is only
+    # locked to copy them and to read the selected rows.
+    def get_valid(self, limit=1000, anonymous=True, age_secs=3600,
+                  protocol=None, ignore_countries=None):
+        max_age = to_timestamp(datetime.utcnow()) - age_secs
+        ok = ProxyStatus.OK
+        ignore = set(pack_country(c) for c in ignore_countries or [])
+
+        with self.lock:
+            snapshot = [(self.latency[slot], slot, self.scan_date[slot],
+                         self.anonymous[slot], self.protocol[slot],
+                         self.country[slot]) for slot in self.valid]
+
+        snapshot = [entry for entry in snapshot
+                    if entry[2] > max_age and
+                    (not anonymous or entry[3] == ok) and
+                    (protocol is None or entry[4] == protocol) and
+                    entry[5] not in ignore]
+        slots = [entry[1] for entry in heapq.nsmallest(limit, snapshot)]
+
+        with self.lock:
+            # Skip proxies updated or deleted since the snapshot.
+            result = [self.__db_row(slot) for slot in slots
+                      if slot in self.valid]
+
+        return [self.__format(proxy) for proxy in result]
+
+    def purge_failed(self, expire_days=0, ignore_countries=None):
+        count = 0
+        max_age = 0
+        if expire_days:
+            max_age = (to_timestamp(datetime.utcnow()) -
+                       timedelta(days=expire_days).total_seconds())
+        ignore = set(pack_country(c) for c in ignore_countries or [])
+
+        with self.lock:
+            failed = [h for h, slot in self.index.items()
+                      if self.fail_count[slot] >= 5 or
+                      self.country[slot] in ignore or
+                      (self.insert_date[slot] < max_age and
+                       self.latency[slot] == NO_LATENCY)]
+            for proxy_hash in failed:
+                slot = self.index.pop(proxy_hash)
+                self.dirty.discard(slot)
+                self.valid.discard(slot)
+                self.credentials.pop(slot, None)
+                self.free_slots.append(slot)
+                count += 1
+
+            self.__compact()
+
+        log.info('Purged %d failed proxies from memory store.', count)
+        return count
+
+    def flush(self):
+        with self.lock:
+            if not self.dirty:
+                return 0
+            proxies = [self.__db_row(slot) for slot in self.dirty
+                       if self.hash[slot] in self.index]
+            self.dirty = set()
+            self.__compact()
+
+        count = 0
+        for idx in range(0, len(proxies), db_step):
+            batch = proxies[idx:idx + db_step]
+            try:
+                with Proxy.database().atomic():
+                    Proxy.insert_many(batch).on_conflict_replace().execute()
+                count += len(batch)
+            except Exception as e:
+                log.exception('Failed to flush %d proxies to database: %s',
+                              len(batch), e)
+                # Mark unsaved proxies as dirty again.
+                with self.lock:
+                    for proxy in proxies[idx:]:
+                        slot = self.index.get(proxy['hash'])
+                        if slot is not None:
+                            self.dirty.add(slot)
+                break
+
+        log.info('Flushed %d proxies from memory store to database.', count)
+        return count
+
+    def __flush_worker(self):
+        while not self.running.is_set():
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except Exception as e:
+                log.exception('Exception in proxy store flusher: %s.', e)
+
+        log.debug('Proxy store flusher shutting down...')
+
+    def __store(self, proxy):
+        slot = self.index.get(proxy['hash'])
+        if slot is None:
+            if self.free_slots:
+                slot = self.free_slots.pop()
+            else:
+                slot = len(self.hash)
+                for column in self.__columns():
+                    column.append(0)
+            self.index[proxy['hash']] = slot
+
+        latency = proxy.get('latency')
+        self.hash[slot] = proxy['hash']
+        self.ip[slot] = proxy['ip']
+        self.port[slot] = int(proxy['port'])
+        self.protocol[slot] = proxy['protocol']
+        self.insert_date[slot] = to_timestamp(proxy['insert_date'])
+        self.scan_date[slot] = to_timestamp(proxy['scan_date'])
+        self.latency[slot] = NO_LATENCY if latency is None else latency
+        self.fail_count[slot] = proxy['fail_count']
+        self.anonymous[slot] = proxy['anonymous']
+        self.niantic[slot] = proxy['niantic']
+        self.ptc_login[slot] = proxy['ptc_login']
+        self.ptc_signup[slot] = proxy['ptc_signup']
+        self.country[slot] = pack_country(proxy['country'])
+
+        if proxy['username']:
+            self.credentials[slot] = (proxy['username'], proxy['password'])
+        else:
+            self.credentials.pop(slot, None)
+
+        self.sources[slot] = proxy['sources']
+
+        ok = ProxyStatus.OK
+        if (self.fail_count[slot] == 0 and self.niantic[slot] == ok and
+                self.ptc_login[slot] == ok and self.ptc_signup[slot] == ok):
+            self.valid.add(slot)
+        else:
+            self.valid.discard(slot)
+
+        if self.scan_date[slot]:
+            heapq.heappush(self.schedule, (self.scan_date[slot],
+                                           self.insert_date[slot], slot))
+        else:
+            score = SourceStats.priority(self.sources[slot], self.priorities)
+            heapq.heappush(self.first_schedule,
+                           (-score, self.insert_date[slot], slot))
+        return slot
+
+    # Rebuild scheduling heaps from live slots when stale entries pile up.
+    def __compact(self):
+        entries = len(self.schedule) + len(self.first_schedule)
+        if entries <= self.COMPACT_FACTOR * len(self.index):
+            return
+
+        schedule = []
+        first_schedule = []
+        for slot in self.index.values():
+            if self.scan_date[slot]:
+                schedule.append((self.scan_date[slot],
+                                 self.insert_date[slot], slot))
+            else:
+                score = SourceStats.priority(self.sources[slot],
+                                             self.priorities)
+                first_schedule.append((-score, self.insert_date[slot], slot))
+
+        heapq.heapify(schedule)
+        heapq.heapify(first_schedule)
+        self.schedule = schedule
+        self.first_schedule = first_schedule
+        log.debug('Compacted memory store schedules from %d to %d entries.',
+                  entries, len(schedule) + len(first_schedule))
+
+    def __columns(self):
+        return (self.hash, self.ip, self.port, self.protocol,
+                self.insert_date, self.scan_date, self.latency,
+                self.fail_count, self.anonymous, self.niantic,
+                self.ptc_login, self.ptc_signup, self.country, self.sources)
+
+    def __db_row(self, slot):
+        latency = self.latency[slot]
+        username, password = self.credentials.get(slot, (None, None))
+        return {
+            'hash': self.hash[slot],
+            'ip': self.ip[slot],
+            'port': self.port[slot],
+            'protocol': self.protocol[slot],
+            'username': username,
+            'password': password,
+            'insert_date': from_timestamp(self.insert_date[slot]),
+            'scan_date': from_timestamp(self.scan_date[slot]),
+            'latency': None if latency == NO_LATENCY else latency,
+            'fail_count': self.fail_count[slot],
+            'anonymous': self.anonymous[slot],
+            'niantic': self.niantic[slot],
+            'ptc_login': self.ptc_login[slot],
+            'ptc_signup': self.ptc_signup[slot],
+            'country': unpack_country(self.country[slot]),
+            'sources': self.sources[slot]}
+
+    def __format(self, proxy):
+        proxy['ip'] = int2ip(proxy['ip'])
+        proxy['url'] = Proxy.url_format(proxy)
+        return proxy
@@ -2,7 +2,9 @@
 # -*- coding: utf-8 -*-
 
 import logging
+import os
 import requests
+import socket
 import time
 
 from datetime import datetime
@@ -14,9 +16,9 @@ from requests.exceptions import ConnectionError, ConnectTimeout
 from timeit import default_timer
 from threading import Event, Lock, Thread
 
-from .ip2location import IP2LocationDatabase
-from .models import ProxyStatus, Proxy
+from .models import ProxyStatus, Proxy, ProxyStats, ProxyTest, SourceStats
 from .utils import export_file, parse_azevn
+from .valid_pool import ValidPool
 
 
 log = logging.getLogger(__name__)
@@ -51,28 +53,45 @@ class ProxyTester():
     STATUS_FORCELIST = [500, 502, 503, 504]
     STATUS_BANLIST = [403, 409]
 
-    def __init__(self, args):
+    VALID_POOL_PRELOAD = 10000
+
+    def __init__(self, args, ip2location, proxy_store=None):
         self.debug = args.verbose
         self.download_path = args.download_path
         self.timeout = args.tester_timeout
         self.max_concurrency = args.tester_max_concurrency
         self.disable_anonymity = args.tester_disable_anonymity
         self.notice_interval = args.tester_notice_interval
+        self.flush_interval = args.db_flush_interval
         self.pogo_version = args.tester_pogo_version
 
+        self.lease_time = args.tester_lease_time
+        self.instance_id = args.tester_instance_id
+        if not self.instance_id:
+            self.instance_id = '{}-{}'.format(socket.gethostname(), os.getpid())
+        # Leave room in lease owner field for the claim sequence number.
+        self.instance_id = self.instance_id[:48]
+        self.claim_sequence = 0
+
         self.scan_interval = args.proxy_scan_interval
-        self.ignore_country = args.proxy_ignore_country
 
         self.proxy_judge = args.proxy_judge
         self.local_ip = args.local_ip
 
-        self.ip2location = IP2LocationDatabase(args)
+        self.ip2location = ip2location
+        self.proxy_store = proxy_store
 
         self.running = Event()
         self.test_queue = Queue()
         self.test_hashes = []
         self.proxy_updates_lock = Lock()
         self.proxy_updates = {}
+        self.valid_pool = ValidPool(self.scan_interval)
+        self.history_days = args.db_history_days
+        self.proxy_tests = []
+        # First test results by source: {source: [tests, passes]}.
+        self.source_results = {}
+        self.source_priorities = None
 
         self.stats = {
             'valid': 0,
@@ -92,6 +111,22 @@ class ProxyTester():
             status_forcelist=self.STATUS_FORCELIST)
 
     def launch(self):
+        # Load working proxies into valid pool.
+        ignore_countries = list(self.ip2location.ignore_codes)
+        if self.proxy_store is not None:
+            proxylist = self.proxy_store.get_valid(
+                self.VALID_POOL_PRELOAD, False, self.scan_interval,
+                ignore_countries=ignore_countries)
+        else:
+            proxylist = Proxy.get_valid(
+                self.VALID_POOL_PRELOAD, False, self.scan_interval,
+                ignore_countries=ignore_countries)
+
+        uptimes = {}
+        if self.history_days:
+            uptimes = ProxyStats.get_uptimes(p['hash'] for p in proxylist)
+        self.valid_pool.load(proxylist, uptimes)
+
         # Start proxy manager thread.
         manager = Thread(name='proxy-manager',
                          target=self.__test_manager)
@@ -293,6 +328,7 @@ class ProxyTester():
         return result
 
     def __update_proxy(self, proxy, valid=False):
+        first_test = proxy['scan_date'] is None
         proxy['scan_date'] = datetime.utcnow()
         if valid:
             proxy['fail_count'] = 0
@@ -303,14 +339,58 @@ class ProxyTester():
             self.stats['fail'] += 1
             self.stats['total_fail'] += 1
 
+        self.valid_pool.update(proxy, valid)
         proxy = Proxy.db_format(proxy)
         with self.proxy_updates_lock:
             self.test_hashes.remove(proxy['hash'])
-            self.proxy_updates[proxy['hash']] = proxy
+            if self.proxy_store is not None:
+                self.proxy_store.update(proxy)
+            else:
+                self.proxy_updates[proxy['hash']] = proxy
+
+            if self.history_days:
+                self.proxy_tests.append(ProxyTest.db_format(proxy))
+
+            if first_test:
+                self.__record_sources(proxy['sources'], valid)
+
+    # Count first test result for each source where proxy was found.
+    def __record_sources(self, sources, valid):
+        source = 0
+        while sources:
+            if sources & 1:
+                results = self.source_results.setdefault(source, [0, 0])
+                results[0] += 1
+                if valid:
+                    results[1] += 1
+            sources >>= 1
+            source += 1
+
+    # Store source results and refresh source priorities for scans.
+    def __update_sources(self):
+        with self.proxy_updates_lock:
+            results = self.source_results
+            self.source_results = {}
+
+        SourceStats.record(results)
+        self.source_priorities = SourceStats.get_priorities()
+        if self.proxy_store is not None:
+            self.proxy_store.set_priorities(self.source_priorities)
 
     def __run_tests(self, proxy):
         result = True
 
+        # Geolocate proxy once and skip tests for ignored countries.
+        if not proxy.get('country'):
+            proxy['country'] = self.ip2location.lookup_country_code(
+                proxy['ip'])
+
+        if proxy['country'] in self.ip2location.ignore_codes:
+            log.debug('%s discarded because country %s is ignored.',
+                      proxy['url'], proxy['country'])
+            self.__update_proxy(proxy, valid=False)
+            return False
+
         session = requests.Session()
 
         session.mount('http://', HTTPAdapter(max_retries=self.retries))
@@ -343,28 +423,31 @@ class ProxyTester():
             latency_total = sum(latency)
             proxy['latency'] = int(latency_total * 1000 / len(latency))
 
-            country = self.ip2location.lookup_country(proxy['ip'])
             log.info('%s (%dms - %s) passed all tests.',
-                     proxy['url'], proxy['latency'], country)
-
-            for ignore_country in self.ignore_country:
-                if ignore_country in country:
-                    result = False
-                    log.warning('%s discarded because country %s is ignored.',
-                                proxy['url'], country)
-                    break
+                     proxy['url'], proxy['latency'], proxy['country'])
 
         self.__update_proxy(proxy, valid=valid)
         session.close()
         return valid
 
+    # Put back updates that failed to be written, newer results for the
+    # same proxies are kept.
+    def __restore_updates(self, proxies, results):
+        with self.proxy_updates_lock:
+            for proxy in proxies:
+                self.proxy_updates.setdefault(proxy['hash'], proxy)
+            self.proxy_tests = results + self.proxy_tests
+
     def __test_manager(self):
         notice_timer = default_timer()
+        flush_timer = notice_timer
+        self.__update_sources()
         while True:
             now = default_timer()
 
             # Print statistics regularly.
             if now >= notice_timer + self.notice_interval:
+                self.__update_sources()
                 log.info('Tested a total of %d good and %d bad proxies.',
                          self.stats['total_valid'], self.stats['total_fail'])
                 log.info('Tested %d good and %d bad proxies in last %ds.',
@@ -376,41 +459,94 @@ class ProxyTester():
                 self.stats['fail'] = 0
 
             try:
+                # Take pending results under the lock, the database is
+                # updated after releasing it so testers are not blocked.
                 with self.proxy_updates_lock:
                     queue_size = self.test_queue.qsize()
                     log.debug('%d proxy tests running...',
                               len(self.test_hashes) - queue_size)
 
-                    # Upsert updated proxies into database.
-                    updates_count = len(self.proxy_updates)
-                    if updates_count > 10:
+                    # Write in batches, pending updates are flushed at
+                    # least every flush interval to release their leases.
+                    flush = now >= flush_timer + self.flush_interval
+                    proxies = []
+                    if (len(self.proxy_updates) > 10 or
+                            (flush and self.proxy_updates)):
                         proxies = list(self.proxy_updates.values())
-                        result = False
-                        with Proxy.database().atomic():
-                            result = Proxy.insert_many(proxies).on_conflict_replace().execute()
-
-                        if result:
-                            log.info('Updated %d proxies to database.',
-                                     updates_count)
-                        else:
-                            log.warning('Failed to upsert %d proxies.',
-                                        updates_count)
                         self.proxy_updates = {}
 
-                    # Request more proxies to test.
-                    refill = self.max_concurrency - queue_size
+                    results = []
+                    if len(self.proxy_tests) > 10 or flush:
+                        results = self.proxy_tests
+                        self.proxy_tests = []
 
-                    if refill > 0:
-                        refill = min(refill, self.max_concurrency)
-                        proxylist = Proxy.get_scan(
-                            refill, self.test_hashes, self.scan_interval)
-                        count = 0
+                    test_hashes = list(self.test_hashes)
+
+                if flush:
+                    flush_timer = now
+
+                # Upsert updated proxies into database, this also
+                # releases their leases.
+                updates_count = len(proxies)
+                if updates_count > 0:
+                    result = False
+                    try:
+                        with Proxy.database().atomic():
+                            result = Proxy.insert_many(proxies).on_conflict_replace().execute()
+                    except Exception as e:
+                        log.exception('Failed to upsert %d proxies: %s',
+                                      updates_count, e)
+
+                    if result:
+                        log.info('Updated %d proxies to database.',
+                                 updates_count)
+                    else:
+                        log.warning('Failed to upsert %d proxies, retrying '
+                                    'later.', updates_count)
+                        self.__restore_updates(proxies, [])
+
+                # Store test results history and update statistics.
+                if results:
+                    failed = []
+                    ProxyTest.insert_results(results, failed)
+                    if failed:
+                        self.__restore_updates([], failed)
+
+                    stored = set(r['hash'] for r in results) - set(
+                        r['hash'] for r in failed)
+                    if stored:
+                        uptimes = ProxyStats.rollup(stored, self.history_days)
+                        self.valid_pool.set_uptimes(uptimes)
+
+                # Request more proxies to test.
+                refill = self.max_concurrency - queue_size
+
+                if refill > 0:
+                    refill = min(refill, self.max_concurrency)
+                    ignore_countries = list(self.ip2location.ignore_codes)
+                    if self.proxy_store is not None:
+                        proxylist = self.proxy_store.get_scan(
+                            refill, test_hashes, self.scan_interval,
+                            ignore_countries=ignore_countries)
+                    else:
+                        self.claim_sequence += 1
+                        owner = '{}:{}'.format(self.instance_id,
+                                               self.claim_sequence)
+                        proxylist = Proxy.claim_scan(
+                            owner, refill, self.lease_time,
+                            self.scan_interval, test_hashes,
+                            ignore_countries=ignore_countries,
+                            priorities=self.source_priorities)
+
+                    with self.proxy_updates_lock:
                         for proxy in proxylist:
-                            self.test_queue.put(proxy)
                             self.test_hashes.append(proxy['hash'])
-                            count += 1
 
-                        log.debug('Enqueued %d proxies for testing.', count)
+                    for proxy in proxylist:
+                        self.test_queue.put(proxy)
+
+                    log.debug('Enqueued %d proxies for testing.',
+                              len(proxylist))
 
             except Exception as e:
                 log.exception('Exception in proxy manager: %s.', e)
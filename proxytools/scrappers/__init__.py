@@ -1,10 +1,52 @@
 #!/usr/bin/python
 # -*- coding: utf-8 -*-
 
-__all__ = [
-    'FileReader',
-    'Proxyserverlist24',
-    'Sockslist',
-    'Socksproxylist24',
-    'Vipsocks24'
-]
+from collections import OrderedDict
+from importlib import import_module
+
+from ..models import ProxyProtocol
+
+# Registry of webpage scrappers by name, scrapper modules are only
+# imported when a scrapper is created.
+# Format: name -> (module, class name, protocol, enabled by default)
+SCRAPPERS = OrderedDict([
+    ('freeproxylist-net',
+     ('freeproxylist', 'Freeproxylist', ProxyProtocol.HTTP, True)),
+    ('premproxy-com',
+     ('premproxy', 'Premproxy', ProxyProtocol.HTTP, True)),
+    ('proxyserverlist24-top',
+     ('proxyserverlist24', 'Proxyserverlist24', ProxyProtocol.HTTP, True)),
+    ('spys-one-https',
+     ('spysone', 'SpysHTTPS', ProxyProtocol.HTTP, True)),
+    ('proxynova-com',
+     ('proxynova', 'ProxyNova', ProxyProtocol.HTTP, True)),
+    # Offline.
+    ('idcloak-com',
+     ('idcloak', 'Idcloak', ProxyProtocol.HTTP, False)),
+    ('sockslist-net',
+     ('sockslist', 'Sockslist', ProxyProtocol.SOCKS5, True)),
+    ('socksproxy-net',
+     ('socksproxy', 'Socksproxy', ProxyProtocol.SOCKS5, True)),
+    ('spys-one-socks',
+     ('spysone', 'SpysSOCKS', ProxyProtocol.SOCKS5, True)),
+    ('vipsocks24-net',
+     ('vipsocks24', 'Vipsocks24', ProxyProtocol.SOCKS5, True)),
+    # Duplicate of vipsocks24-net.
+    ('socksproxylist24-top',
+     ('socksproxylist24', 'Socksproxylist24', ProxyProtocol.SOCKS5, False)),
+])
+
+
+# Names of scrappers for `protocol` enabled by default or in `enable`
+# and not in `disable`.
+def scrapper_names(protocol, enable=[], disable=[]):
+    return [name for name, (module, class_name, proto, default)
+            in SCRAPPERS.items()
+            if proto == protocol and name not in disable and
+            (default or name in enable)]
+
+
+def create_scrapper(name, args):
+    module, class_name = SCRAPPERS[name][:2]
+    module = import_module('.' + module, __name__)
+    return getattr(module, class_name)(args)
@@ -1,23 +1,101 @@
 #!/usr/bin/python
 # -*- coding: utf-8 -*-
 
+import json
 import logging
+import os
 
 from ..proxy_scrapper import ProxyScrapper
-from ..utils import load_file
 
 log = logging.getLogger(__name__)
 
 
 class FileReader(ProxyScrapper):
+    SOURCE_ID = 0
+    CHECKPOINT_FILE = 'filereader-checkpoint.json'
+    CHUNK_SIZE = 64 * 1024
 
     def __init__(self, args):
         super(FileReader, self).__init__(args, 'file-reader')
         self.proxy_file = args.proxy_file
+        self.tail = args.proxy_file_tail or args.proxy_file_watch > 0
+        self.checkpoint_file = os.path.join(
+            args.download_path, self.CHECKPOINT_FILE)
+        self.stat = None
 
+    # Load byte offset from previous read, reset if file was rotated
+    # (different inode) or truncated (smaller than our offset).
+    def load_checkpoint(self, stat):
+        try:
+            with open(self.checkpoint_file, 'r') as fd:
+                checkpoint = json.load(fd)
+        except (IOError, ValueError):
+            return 0
+
+        if (checkpoint.get('filename') != self.proxy_file or
+                checkpoint.get('inode') != stat.st_ino):
+            log.info('Proxy file %s was replaced, reading from start.',
+                     self.proxy_file)
+            return 0
+
+        offset = checkpoint.get('offset', 0)
+        if stat.st_size < offset:
+            log.info('Proxy file %s was truncated, reading from start.',
+                     self.proxy_file)
+            return 0
+
+        return offset
+
+    def save_checkpoint(self, stat, offset):
+        checkpoint = {
+            'filename': self.proxy_file,
+            'inode': stat.st_ino,
+            'offset': offset}
+
+        temp_file = self.checkpoint_file + '.tmp'
+        with open(temp_file, 'w') as fd:
+            json.dump(checkpoint, fd)
+        os.replace(temp_file, self.checkpoint_file)
+
+    # Check if proxy file has complete lines we have not read yet.
+    def has_changed(self):
+        try:
+            with open(self.proxy_file, 'rb') as f:
+                f.seek(self.load_checkpoint(os.fstat(f.fileno())))
+                while True:
+                    chunk = f.read(self.CHUNK_SIZE)
+                    if not chunk:
+                        return False
+                    if b'\n' in chunk:
+                        return True
+        except (IOError, OSError):
+            return False
+
+    def commit(self, position):
+        if self.tail:
+            self.save_checkpoint(self.stat, position)
+
+    # Stream proxies from file without loading it into memory.
+    # In tail mode only complete lines appended since last read are
+    # returned, the byte offset is committed once they are stored.
     def scrap(self):
-        proxylist = load_file(self.proxy_file)
-        log.info('Read %d proxies from file: %s',
-                 len(proxylist), self.proxy_file)
+        count = 0
+        with open(self.proxy_file, 'rb') as f:
+            self.stat = os.fstat(f.fileno())
+            offset = self.load_checkpoint(self.stat) if self.tail else 0
+            f.seek(offset)
+            self.position = offset
+            for line in f:
+                # Leave partially written lines for the next read.
+                if self.tail and not line.endswith(b'\n'):
+                    break
+
+                self.position += len(line)
+                line = line.decode('utf-8', 'replace').strip()
+
+                # Ignore blank lines and comment lines.
+                if line and not line.startswith('#'):
+                    count += 1
+                    yield line
 
-        return proxylist
+        log.info('Read %d proxies from file: %s', count, self.proxy_file)
@@ -3,14 +3,13 @@
 
 import logging
 
-from bs4 import BeautifulSoup
-
 from ..proxy_scrapper import ProxyScrapper
 
 log = logging.getLogger(__name__)
 
 
 class Freeproxylist(ProxyScrapper):
+    SOURCE_ID = 1
 
     def __init__(self, args):
         super(Freeproxylist, self).__init__(args, 'freeproxylist-net')
@@ -18,21 +17,18 @@ class Freeproxylist(ProxyScrapper):
 
     def scrap(self):
         self.setup_session()
-        proxylist = []
 
-        html = self.request_url(self.base_url)
-        if html is None:
+        proxylist = self.scrap_url(self.base_url, self.parse_webpage)
+        if proxylist is None:
             log.error('Failed to download webpage: %s', self.base_url)
         else:
-            log.info('Parsing proxylist from webpage: %s', self.base_url)
-            proxylist = self.parse_webpage(html)
+            yield from proxylist
 
         self.session.close()
-        return proxylist
 
     def parse_webpage(self, html):
         proxylist = []
-        soup = BeautifulSoup(html, 'html.parser')
+        soup = self.make_soup(html, 'table', {'id': 'proxylisttable'})
 
         table = soup.find('table', attrs={'id': 'proxylisttable'})
 
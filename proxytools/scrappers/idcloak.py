@@ -5,8 +5,6 @@ import logging
 import random
 import time
 
-from bs4 import BeautifulSoup
-
 from ..proxy_scrapper import ProxyScrapper
 
 log = logging.getLogger(__name__)
@@ -15,6 +13,7 @@ log = logging.getLogger(__name__)
 # idcloak.com does offer SOCKS5 and SOCKS4 but don't appear too often.
 # For now we'll just be scrapping the HTTP/HTTPS protocols.
 class Idcloak(ProxyScrapper):
+    SOURCE_ID = 3
 
     def __init__(self, args):
         super(Idcloak, self).__init__(args, 'idcloak-com')
@@ -23,15 +22,14 @@ class Idcloak(ProxyScrapper):
     def scrap(self):
         self.setup_session()
         page = 1
-        proxylist = []
 
         proxies, next_page = self.scrap_page(page)
         if not proxies:
             log.error('Scrapping aborted, found no proxies in main page: %s',
                       self.base_url)
-            return proxylist
+            return
 
-        proxylist.extend(proxies)
+        yield from proxies
 
         while next_page:
             page = next_page
@@ -42,10 +40,9 @@ class Idcloak(ProxyScrapper):
                 log.info('Scrapping finished, transparent proxies ignored.')
                 break
 
-            proxylist.extend(proxies)
+            yield from proxies
 
         self.session.close()
-        return proxylist
 
     def scrap_page(self, page):
         payload = {
@@ -64,7 +61,7 @@ class Idcloak(ProxyScrapper):
             log.info('Parsing proxylist from webpage: %s, page: %d',
                      self.base_url, page)
 
-            soup = BeautifulSoup(html, 'html.parser')
+            soup = self.make_soup(html, ['table', 'div'])
             proxylist = self.parse_webpage(soup)
             next_page = self.parse_next_page(soup)
 
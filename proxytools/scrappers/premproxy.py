@@ -6,42 +6,45 @@ import random
 import re
 import time
 
-from bs4 import BeautifulSoup
-
 from ..packer import deobfuscate
 from ..proxy_scrapper import ProxyScrapper
 
 log = logging.getLogger(__name__)
 
+PORTS_PATTERN = re.compile(r"\(\'\.([\w]+)\'\).html\((\d+)\)")
+
 
 # PremProxy.com has anti-scrapping measures and pages might not be loaded.
 # This should only happen if you scrap this site too frequently.
 class Premproxy(ProxyScrapper):
+    SOURCE_ID = 2
 
     def __init__(self, args):
         super(Premproxy, self).__init__(args, 'premproxy-com')
         self.base_url = 'https://premproxy.com'
+        self.ports_cache = {}
 
     def scrap(self):
         self.setup_session()
-        proxylist = []
+        # Same ports script is used by every page, only parse it once.
+        self.ports_cache = {}
 
         url = self.base_url + '/list/'
         html = self.request_url(url)
         if html is None:
             log.error('Failed to download webpage: %s', url)
-            return proxylist
+            return
 
         log.info('Parsing proxylist from webpage: %s', url)
-        soup = BeautifulSoup(html, 'html.parser')
+        soup = self.make_soup(html, ['script', 'tr', 'ul'])
         proxies = self.parse_webpage(soup)
 
         if not proxies:
             log.error('Scrapping aborted, found no proxies in main page: %s',
                       url)
-            return proxylist
+            return
 
-        proxylist.extend(proxies)
+        yield from proxies
 
         next_url = self.parse_next_url(soup)
         while next_url:
@@ -50,22 +53,21 @@ class Premproxy(ProxyScrapper):
             html = self.request_url(next_url, url)
             if html is None:
                 log.error('Failed to download webpage: %s', next_url)
-                return proxylist
+                return
 
             log.info('Parsing proxylist from webpage: %s', next_url)
-            soup = BeautifulSoup(html, 'html.parser')
+            soup = self.make_soup(html, ['script', 'tr', 'ul'])
 
             proxies = self.parse_webpage(soup)
             if not proxies:
                 log.info('Scrapping finished, transparent proxies ignored.')
                 break
 
-            proxylist.extend(proxies)
+            yield from proxies
             url = next_url
             next_url = self.parse_next_url(soup)
 
         self.session.close()
-        return proxylist
 
     def parse_webpage(self, soup):
         proxylist = []
@@ -145,6 +147,9 @@ class Premproxy(ProxyScrapper):
     # Check if script file has the decoding function and build a dictionary
     # with the decoding information: {'<key>': <port>, ...}.
     def extract_ports(self, js_url):
+        if js_url in self.ports_cache:
+            return self.ports_cache[js_url]
+
         dictionary = {}
 
         # Download the JS file.
@@ -157,12 +162,13 @@ class Premproxy(ProxyScrapper):
             # Check to see if script contains the decoding function.
             clean_code = deobfuscate(js)
             if not clean_code:
+                self.ports_cache[js_url] = dictionary
                 return dictionary
 
             # Extract all the key,port pairs found in unpacked script.
             # Format: $('.<key>').html(<port>);
             clean_code = clean_code.replace("\\\'", "\'")
-            matches = re.findall("\(\'\.([\w]+)\'\).html\((\d+)\)", clean_code)
+            matches = PORTS_PATTERN.findall(clean_code)
 
             # Convert matches list into a dictionary for decoding.
             for match in matches:
@@ -172,4 +178,5 @@ class Premproxy(ProxyScrapper):
             log.exception('Failed to extract decoding dictionary from %s: %s.',
                           js_url, e)
 
+        self.ports_cache[js_url] = dictionary
         return dictionary
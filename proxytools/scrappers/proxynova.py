@@ -4,14 +4,13 @@
 import logging
 import re
 
-from bs4 import BeautifulSoup
-
 from ..proxy_scrapper import ProxyScrapper
 
 log = logging.getLogger(__name__)
 
 
 class ProxyNova(ProxyScrapper):
+    SOURCE_ID = 11
 
     def __init__(self, args):
         super(ProxyNova, self).__init__(args, 'proxynova-com')
@@ -23,24 +22,20 @@ class ProxyNova(ProxyScrapper):
 
     def scrap(self):
         self.setup_session()
-        proxylist = []
 
         for url in self.urls:
-            html = self.request_url(url, self.base_url)
-            if html is None:
+            proxies = self.scrap_url(url, self.parse_webpage, self.base_url)
+            if proxies is None:
                 log.error('Failed to download webpage: %s', url)
                 continue
 
-            log.info('Parsing proxylist from webpage: %s', url)
-            proxies = self.parse_webpage(html)
-            proxylist.extend(proxies)
+            yield from proxies
 
         self.session.close()
-        return proxylist
 
     def parse_webpage(self, html):
         proxylist = []
-        soup = BeautifulSoup(html, 'html.parser')
+        soup = self.make_soup(html, 'table', {'id': 'tbl_proxy_list'})
 
         table = soup.find('table', attrs={'id': 'tbl_proxy_list'})
         tbody = table.find('tbody')
@@ -3,14 +3,13 @@
 
 import logging
 
-from bs4 import BeautifulSoup
-
 from ..proxy_scrapper import ProxyScrapper
 
 log = logging.getLogger(__name__)
 
 
 class Proxyserverlist24(ProxyScrapper):
+    SOURCE_ID = 4
 
     def __init__(self, args):
         super(Proxyserverlist24, self).__init__(args, 'proxyserverlist24-top')
@@ -18,7 +17,6 @@ class Proxyserverlist24(ProxyScrapper):
 
     def scrap(self):
         self.setup_session()
-        proxylist = []
         html = self.request_url(self.base_url)
 
         if html is None:
@@ -28,20 +26,20 @@ class Proxyserverlist24(ProxyScrapper):
             urls = self.parse_links(html)
 
             for url in urls:
-                html = self.request_url(url, self.base_url)
-                if html is None:
+                proxies = self.scrap_url(
+                    url, self.parse_webpage, self.base_url)
+                if proxies is None:
                     log.error('Failed to download webpage: %s', url)
                     continue
 
-                log.info('Parsing proxylist from webpage: %s', url)
-                proxylist.extend(self.parse_webpage(html))
+                yield from proxies
 
         self.session.close()
-        return proxylist
 
     def parse_links(self, html):
         urls = []
-        soup = BeautifulSoup(html, 'html.parser')
+        soup = self.make_soup(
+            html, 'h3', class_='post-title entry-title')
 
         for post_title in soup.find_all('h3', class_='post-title entry-title'):
             url = post_title.find('a')
@@ -61,7 +59,7 @@ class Proxyserverlist24(ProxyScrapper):
 
     def parse_webpage(self, html):
         proxylist = []
-        soup = BeautifulSoup(html, 'html.parser')
+        soup = self.make_soup(html, 'pre', {'class': 'alt2', 'dir': 'ltr'})
 
         container = soup.find('pre', attrs={'class': 'alt2', 'dir': 'ltr'})
         if not container:
@@ -4,17 +4,18 @@
 import logging
 import re
 
-from bs4 import BeautifulSoup
-
 from ..crazyxor import parse_crazyxor, decode_crazyxor
 from ..proxy_scrapper import ProxyScrapper
 from ..utils import validate_ip
 
 log = logging.getLogger(__name__)
 
+PORT_PATTERN = re.compile(r"document.write\(([\w\^]+)\)")
+
 
 # Sockslist.net uses javascript to obfuscate proxies port number.
 class Sockslist(ProxyScrapper):
+    SOURCE_ID = 5
 
     def __init__(self, args):
         super(Sockslist, self).__init__(args, 'sockslist-net')
@@ -27,27 +28,23 @@ class Sockslist(ProxyScrapper):
 
     def scrap(self):
         self.setup_session()
-        proxylist = []
         for url in self.urls:
-            html = self.request_url(url, self.base_url)
-            if html is None:
+            proxies = self.scrap_url(url, self.parse_webpage, self.base_url)
+            if proxies is None:
                 log.error('Failed to download webpage: %s', url)
                 continue
 
-            log.info('Parsing proxylist from webpage: %s', url)
-            proxies = self.parse_webpage(html)
             if not proxies:
                 break
 
-            proxylist.extend(proxies)
+            yield from proxies
 
         self.session.close()
-        return proxylist
 
     def parse_webpage(self, html):
         proxylist = []
         encoding = {}
-        soup = BeautifulSoup(html, 'html.parser')
+        soup = self.make_soup(html, ['script', 'table'])
 
         for script in soup.find_all('script'):
             code = script.string
@@ -77,7 +74,6 @@ class Sockslist(ProxyScrapper):
 
             return proxylist
 
-        pattern = re.compile(r"document.write\(([\w\^]+)\)")
         for table_row in table.find_all('tr'):
             ip_td = table_row.find('td', class_='t_ip')
             if ip_td is None:
@@ -92,7 +88,7 @@ class Sockslist(ProxyScrapper):
             port_script = port_td.find('script').string
             try:
                 # Find encoded string with proxy port.
-                m = pattern.search(port_script)
+                m = PORT_PATTERN.search(port_script)
                 # Decode proxy port using secret encoding dictionary.
                 port = decode_crazyxor(encoding, m.group(1))
                 if not port.isdigit():
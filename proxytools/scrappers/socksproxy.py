@@ -3,14 +3,13 @@
 
 import logging
 
-from bs4 import BeautifulSoup
-
 from ..proxy_scrapper import ProxyScrapper
 
 log = logging.getLogger(__name__)
 
 
 class Socksproxy(ProxyScrapper):
+    SOURCE_ID = 6
 
     def __init__(self, args):
         super(Socksproxy, self).__init__(args, 'socksproxy-net')
@@ -18,23 +17,19 @@ class Socksproxy(ProxyScrapper):
 
     def scrap(self):
         self.setup_session()
-        proxylist = []
 
-        html = self.request_url(self.base_url)
-        if html is None:
+        proxylist = self.scrap_url(self.base_url, self.parse_webpage)
+        if proxylist is None:
             log.error('Failed to download webpage: %s', self.base_url)
         else:
-            log.info('Parsing proxylist from webpage: %s', self.base_url)
-
-            soup = BeautifulSoup(html, 'html.parser')
-            proxylist = self.parse_webpage(soup)
+            yield from proxylist
 
         self.session.close()
-        return proxylist
 
-    def parse_webpage(self, soup):
+    def parse_webpage(self, html):
         proxylist = []
         counter = 0
+        soup = self.make_soup(html, 'table', {'id': 'proxylisttable'})
 
         table = soup.find('table', attrs={'id': 'proxylisttable'})
 
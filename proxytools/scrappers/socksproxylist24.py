@@ -3,14 +3,13 @@
 
 import logging
 
-from bs4 import BeautifulSoup
-
 from ..proxy_scrapper import ProxyScrapper
 
 log = logging.getLogger(__name__)
 
 
 class Socksproxylist24(ProxyScrapper):
+    SOURCE_ID = 7
 
     def __init__(self, args):
         super(Socksproxylist24, self).__init__(args, 'socksproxylist24-top')
@@ -18,7 +17,6 @@ class Socksproxylist24(ProxyScrapper):
 
     def scrap(self):
         self.setup_session()
-        proxylist = []
         html = self.request_url(self.base_url)
 
         if html is None:
@@ -28,20 +26,20 @@ class Socksproxylist24(ProxyScrapper):
             urls = self.parse_links(html)
 
             for url in urls:
-                html = self.request_url(url, self.base_url)
-                if html is None:
+                proxies = self.scrap_url(
+                    url, self.parse_webpage, self.base_url)
+                if proxies is None:
                     log.error('Failed to download webpage: %s', url)
                     continue
 
-                log.info('Parsing proxylist from webpage: %s', url)
-                proxylist.extend(self.parse_webpage(html))
+                yield from proxies
 
         self.session.close()
-        return proxylist
 
     def parse_links(self, html):
         urls = []
-        soup = BeautifulSoup(html, 'html.parser')
+        soup = self.make_soup(
+            html, 'h3', class_='post-title entry-title')
 
         for post_title in soup.find_all('h3', class_='post-title entry-title'):
             url = post_title.find('a')
@@ -60,7 +58,7 @@ class Socksproxylist24(ProxyScrapper):
 
     def parse_webpage(self, html):
         proxylist = []
-        soup = BeautifulSoup(html, 'html.parser')
+        soup = self.make_soup(html, 'textarea')
 
         textarea = soup.find('textarea', onclick='this.focus();this.select()')
         if textarea is None:
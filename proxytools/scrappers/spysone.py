@@ -6,8 +6,6 @@ import logging
 import re
 # import time
 
-from bs4 import BeautifulSoup
-
 from ..crazyxor import parse_crazyxor, decode_crazyxor
 from ..packer import deobfuscate
 from ..proxy_scrapper import ProxyScrapper
@@ -15,6 +13,9 @@ from ..utils import validate_ip
 
 log = logging.getLogger(__name__)
 
+PORT_PATTERN = re.compile(r'\(([\w\^]+)\)')
+COUNTRY_PATTERN = re.compile(r'([\w\s]+) \(.*')
+
 
 class SpysOne(ProxyScrapper):
 
@@ -23,24 +24,22 @@ class SpysOne(ProxyScrapper):
 
     def scrap(self):
         self.setup_session()
-        proxylist = []
 
         url = self.base_url
-        html = self.request_url(url, url, post=self.post_data)
-        if html is None:
+        proxylist = self.scrap_url(
+            url, self.parse_webpage, url, post=self.post_data)
+        if proxylist is None:
             log.error('Failed to download webpage: %s', url)
         else:
-            log.info('Parsing proxylist from webpage: %s', url)
-            proxylist.extend(self.parse_webpage(html))
+            yield from proxylist
             # time.sleep(random.uniform(2.0, 4.0))
 
         self.session.close()
-        return proxylist
 
     def parse_webpage(self, html):
         proxylist = []
         encoding = {}
-        soup = BeautifulSoup(html, 'html.parser')
+        soup = self.make_soup(html, ['script', 'tr'])
 
         for script in soup.find_all('script'):
 
@@ -109,7 +108,7 @@ class SpysOne(ProxyScrapper):
                 log.warning('Invalid IP found: %s', ip)
                 continue
 
-            matches = re.findall('\(([\w\^]+)\)', script)
+            matches = PORT_PATTERN.findall(script)
             numbers = [decode_crazyxor(encoding, m) for m in matches]
             port = ''.join(numbers)
 
@@ -118,7 +117,7 @@ class SpysOne(ProxyScrapper):
                 continue
 
             country = columns[3].get_text().lower()
-            clean_name = re.match('([\w\s]+) \(.*', country)
+            clean_name = COUNTRY_PATTERN.match(country)
 
             if clean_name:
                 country = clean_name.group(1)
@@ -137,6 +136,7 @@ class SpysOne(ProxyScrapper):
 
 
 class SpysHTTPS(SpysOne):
+    SOURCE_ID = 8
 
     def __init__(self, args):
         super(SpysHTTPS, self).__init__(args, 'spys-one-https')
@@ -145,6 +145,7 @@ class SpysHTTPS(SpysOne):
 
 
 class SpysSOCKS(SpysOne):
+    SOURCE_ID = 9
 
     def __init__(self, args):
         super(SpysSOCKS, self).__init__(args, 'spys-one-socks')
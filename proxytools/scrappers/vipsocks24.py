@@ -1,21 +1,18 @@
 #!/usr/bin/python
 # -*- coding: utf-8 -*-
 
-import io
 import logging
 import json
 import re
 import time
 
-from bs4 import BeautifulSoup
-from zipfile import ZipFile, is_zipfile
-
 from ..proxy_scrapper import ProxyScrapper
 
 log = logging.getLogger(__name__)
 
 
 class Vipsocks24(ProxyScrapper):
+    SOURCE_ID = 10
 
     def __init__(self, args):
         super(Vipsocks24, self).__init__(args, 'vipsocks24-net')
@@ -23,7 +20,6 @@ class Vipsocks24(ProxyScrapper):
 
     def scrap(self):
         self.setup_session()
-        proxylist = []
         html = self.request_url(self.base_url)
 
         if html is None:
@@ -33,20 +29,20 @@ class Vipsocks24(ProxyScrapper):
             urls = self.parse_links(html)
 
             for url in urls:
-                html = self.request_url(url, self.base_url)
-                if html is None:
+                proxies = self.scrap_url(
+                    url, self.parse_webpage, self.base_url)
+                if proxies is None:
                     log.error('Failed to download webpage: %s', url)
                     continue
 
-                log.info('Parsing proxylist from webpage: %s', url)
-                proxylist.extend(self.parse_webpage(html))
+                yield from proxies
 
         self.session.close()
-        return proxylist
 
     def parse_links(self, html):
         urls = []
-        soup = BeautifulSoup(html, 'html.parser')
+        soup = self.make_soup(
+            html, 'h3', class_='post-title entry-title')
 
         for post_title in soup.find_all('h3', class_='post-title entry-title'):
             url = post_title.find('a')
@@ -65,7 +61,7 @@ class Vipsocks24(ProxyScrapper):
 
     def parse_webpage(self, html):
         proxylist = []
-        soup = BeautifulSoup(html, 'html.parser')
+        soup = self.make_soup(html, ['textarea', 'a'])
 
         textarea = soup.find('textarea', onclick='this.focus();this.select()')
         if textarea is None:
@@ -94,7 +90,7 @@ class Vipsocks24(ProxyScrapper):
         # Then request download page (start)
         url = url.replace('file', 'start')
         html = self.request_url(url)
-        soup = BeautifulSoup(html, 'html.parser')
+        soup = self.make_soup(html, 'script')
 
         api_url = ''
         pattern = re.compile(r"ajax\(\{\s*url:\s*'(/api/file/getDownloadServer/.*)'")
@@ -125,24 +121,24 @@ class Vipsocks24(ProxyScrapper):
         proxylist = []
 
         log.info('Downloading proxylist from: %s', url)
-        filename = '{}/{}.zip'.format(self.download_path, self.name)
-        if not self.download_file(url, filename):
+        download = self.download(url)
+        if download is None:
             log.error('Failed proxylist download: %s', url)
             return proxylist
 
-        if not is_zipfile(filename):
-            log.error('File "%s" downloaded from %s is not a Zip archive.',
-                      filename, url)
-            return proxylist
-
-        with ZipFile(filename, 'r') as myzip:
-            for proxyfile in myzip.namelist():
-                if not proxyfile.endswith('.txt'):
-                    log.debug('Skipped file in Zip archive: %s', proxyfile)
-                    continue
-                with myzip.open(proxyfile, 'r') as proxies:
-                    for line in io.TextIOWrapper(proxies, 'utf8'):
+        with download:
+            if not download.is_zipfile():
+                log.error('File downloaded from %s is not a Zip archive.',
+                          url)
+                return proxylist
+
+            # Unzip proxylist from memory, skipping blank lines.
+            try:
+                for line in download.iter_lines('.txt'):
+                    line = line.strip()
+                    if line:
                         proxylist.append(line)
-                    break
+            except Exception as e:
+                log.error('Failed to read proxylist from %s: %s', url, e)
 
         return proxylist
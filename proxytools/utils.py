@@ -30,6 +30,11 @@ def get_args():
     parser.add_argument('--download-path',
                         help='Directory where download files are saved.',
                         default='downloads')
+    parser.add_argument('--ip2location-refresh-days',
+                        help=('Check for IP2Location database updates every '
+                              'X days. Default: 7 (0 disables updates).'),
+                        default=7,
+                        type=int)
     parser.add_argument('-pj', '--proxy-judge',
                         help='URL for AZenv script used to test proxies.',
                         default='http://pascal.hoez.free.fr/azenv.php')
@@ -50,11 +55,63 @@ def get_args():
     group.add_argument('--db-port',
                        help='Port for the database.',
                        type=int, default=3306)
+    group.add_argument('--db-insert-batch',
+                       help=('Number of new proxies inserted per database '
+                             'statement. Default: 5000.'),
+                       default=5000,
+                       type=int)
+    group.add_argument('--db-load-data-threshold',
+                       help=('Bulk load proxylists with at least X proxies '
+                             'using LOAD DATA. Default: 0 (disabled).'),
+                       default=0,
+                       type=int)
+    group.add_argument('--db-purge-chunk',
+                       help=('Number of proxies deleted per statement when '
+                             'cleaning the database. Default: 1000.'),
+                       default=1000,
+                       type=int)
+    group.add_argument('--db-purge-pause',
+                       help=('Pause X seconds between database cleaning '
+                             'statements. Default: 0.1.'),
+                       default=0.1,
+                       type=float)
+    group.add_argument('--db-purge-time',
+                       help=('Maximum time in seconds spent cleaning the '
+                             'database per refresh cycle. Default: 30.'),
+                       default=30,
+                       type=float)
+    group.add_argument('--db-history-days',
+                       help=('Keep proxy test results during X days to rank '
+                             'proxies by reliability. Default: 7 '
+                             '(0 disables test history).'),
+                       default=7,
+                       type=int)
+    group.add_argument('--db-memory-store',
+                       help=('Keep proxies in an in-memory store and flush '
+                             'changes to the database periodically.'),
+                       default=False,
+                       action='store_true')
+    group.add_argument('--db-flush-interval',
+                       help=('Flush in-memory store changes and pending '
+                             'proxy test results to the database every X '
+                             'seconds. Default: 30.'),
+                       default=30,
+                       type=int)
 
     group = parser.add_argument_group('Proxy Sources')
     group.add_argument('-Pf', '--proxy-file',
                        help='Filename of proxy list to verify.',
                        default=None)
+    group.add_argument('-Pft', '--proxy-file-tail',
+                       help=('Only read lines appended to proxy list file '
+                             'since it was last read.'),
+                       default=False,
+                       action='store_true')
+    group.add_argument('-Pfw', '--proxy-file-watch',
+                       help=('Check proxy list file for appended lines every '
+                             'X seconds. Default: 0 (disabled).'),
+                       default=0,
+                       type=int)
     group.add_argument('-Ps', '--proxy-scrap',
                        help='Scrap webpages for proxy lists.',
                        default=False,
@@ -66,7 +123,9 @@ def get_args():
                        choices=('http', 'socks', 'all'))
     group.add_argument('-Pri', '--proxy-refresh-interval',
                        help=('Refresh proxylist from configured sources '
-                             'every X minutes. Default: 180.'),
+                             'every X minutes, each source adapts its '
+                             'interval between 1/4x and 8x of this value '
+                             'based on new proxies found. Default: 180.'),
                        default=180,
                        type=int)
     group.add_argument('-Psi', '--proxy-scan-interval',
@@ -74,6 +133,11 @@ def get_args():
                              'Default: 60.'),
                        default=60,
                        type=int)
+    group.add_argument('-Ped', '--proxy-expire-days',
+                       help=('Delete proxies that never passed tests after '
+                             'X days. Default: 0 (disabled).'),
+                       default=0,
+                       type=int)
     group.add_argument('-Pic', '--proxy-ignore-country',
                        help=('Ignore proxies from countries in this list. '
                              'Default: ["china"]'),
@@ -145,6 +209,15 @@ def get_args():
                              'Default: 60.'),
                        default=60,
                        type=int)
+    group.add_argument('-Tlt', '--tester-lease-time',
+                       help=('Lease proxies claimed for testing during X '
+                             'seconds. Default: 600.'),
+                       default=600,
+                       type=int)
+    group.add_argument('-Tid', '--tester-instance-id',
+                       help=('Identifier for this proxy tester when sharing '
+                             'a database. Default: <hostname>-<pid>.'),
+                       default=None)
     group.add_argument('-Tpv', '--tester-pogo-version',
                        help='PoGo API version currently required by Niantic.',
                        default='0.175.1')
@@ -164,6 +237,41 @@ def get_args():
                        help='Connection timeout in seconds. Default: 5.',
                        default=5,
                        type=float)
+    group.add_argument('-Smc', '--scrapper-max-concurrency',
+                       help=('Maximum number of scrappers running at the '
+                             'same time. Default: 4.'),
+                       default=4,
+                       type=int)
+    group.add_argument('-Shd', '--scrapper-host-delay',
+                       help=('Minimum delay in seconds between requests to '
+                             'the same host. Default: 1.'),
+                       default=1.0,
+                       type=float)
+    group.add_argument('-Sd', '--scrapper-deadline',
+                       help=('Stop waiting for scrappers after X seconds '
+                             'on each refresh. Default: 600.'),
+                       default=600,
+                       type=int)
+    group.add_argument('-Scd', '--scrapper-cache-days',
+                       help=('Delete cached webpages not requested for X '
+                             'days. Default: 7.'),
+                       default=7,
+                       type=int)
+    group.add_argument('-Scs', '--scrapper-cache-size',
+                       help=('Maximum size in MB of cached webpages, least '
+                             'recently requested are deleted first. '
+                             'Default: 64.'),
+                       default=64,
+                       type=int)
+    group.add_argument('-Se', '--scrapper-enable',
+                       help=('Enable proxy scrapper disabled by default, '
+                             'e.g. idcloak-com.'),
+                       default=[],
+                       action='append')
+    group.add_argument('-Sx', '--scrapper-disable',
+                       help='Disable proxy scrapper, e.g. spys-one-socks.',
+                       default=[],
+                       action='append')
     group.add_argument('-Sp', '--scrapper-proxy',
                        help=('Use this proxy for webpage scrapping. '
                              'Format: <proto>://[<user>:<pass>@]<ip>:<port> '
@@ -182,10 +290,10 @@ def load_file(filename):
             stripped = line.strip()
 
             # Ignore blank lines and comment lines.
-            if len(stripped) == 0 or line.startswith('#'):
+            if len(stripped) == 0 or stripped.startswith('#'):
                 continue
 
-            lines.append(lines)
+            lines.append(stripped)
 
         log.info('Read %d lines from file %s.', len(lines), filename)
 
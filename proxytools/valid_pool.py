@@ -0,0 +1,105 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import bisect
+import logging
+
+from datetime import datetime, timedelta
+from threading import Lock
+
+from .models import ProxyStatus
+
+log = logging.getLogger(__name__)
+
+
+# Snapshot of working proxies ordered by uptime then latency.
+# Kept up to date by the proxy tester as results arrive so proxylist
+# outputs can be generated without querying the database.
+class ValidPool(object):
+
+    def __init__(self, age_secs):
+        self.age_secs = age_secs
+        self.lock = Lock()
+        self.proxies = {}
+        # Sorted list of (-uptime, latency, hash) tuples.
+        self.ranking = []
+
+    def __len__(self):
+        return len(self.proxies)
+
+    # Uptimes format: {hash: uptime} from proxy statistics.
+    def load(self, proxylist, uptimes={}):
+        with self.lock:
+            for proxy in proxylist:
+                self.__add(proxy, uptimes.get(proxy['hash'], 0))
+
+        log.info('Loaded %d working proxies into valid pool.', len(self))
+
+    def update(self, proxy, valid):
+        with self.lock:
+            old = self.__remove(proxy['hash'])
+            if valid:
+                self.__add(proxy, old['uptime'] if old else 0)
+
+    # Re-rank proxies in the pool with updated statistics.
+    def set_uptimes(self, uptimes):
+        with self.lock:
+            for proxy_hash, uptime in uptimes.items():
+                proxy = self.__remove(proxy_hash)
+                if proxy is not None:
+                    self.__add(proxy, uptime)
+
+    def get(self, limit=1000, anonymous=True, protocol=None):
+        result = []
+        expired = []
+        max_age = datetime.utcnow() - timedelta(seconds=self.age_secs)
+
+        with self.lock:
+            for uptime, latency, proxy_hash in self.ranking:
+                proxy = self.proxies[proxy_hash]
+                if proxy['scan_date'] < max_age:
+                    expired.append(proxy_hash)
+                    continue
+                if anonymous and proxy['anonymous'] != ProxyStatus.OK:
+                    continue
+                if protocol is not None and proxy['protocol'] != protocol:
+                    continue
+
+                result.append(proxy)
+                if len(result) >= limit:
+                    break
+
+            for proxy_hash in expired:
+                self.__remove(proxy_hash)
+
+        return result
+
+    def __add(self, proxy, uptime):
+        proxy = {
+            'hash': proxy['hash'],
+            'ip': proxy['ip'],
+            'port': proxy['port'],
+            'protocol': proxy['protocol'],
+            'username': proxy['username'],
+            'password': proxy['password'],
+            'url': proxy['url'],
+            'scan_date': proxy['scan_date'],
+            'latency': proxy['latency'],
+            'anonymous': proxy['anonymous'],
+            'uptime': uptime}
+
+        self.proxies[proxy['hash']] = proxy
+        bisect.insort(self.ranking,
+                      (-uptime, proxy['latency'], proxy['hash']))
+
+    def __remove(self, proxy_hash):
+        proxy = self.proxies.pop(proxy_hash, None)
+        if proxy is None:
+            return None
+
+        entry = (-proxy['uptime'], proxy['latency'], proxy_hash)
+        idx = bisect.bisect_left(self.ranking, entry)
+        if idx < len(self.ranking) and self.ranking[idx] == entry:
+            del self.ranking[idx]
+
+        return proxy
@@ -6,12 +6,17 @@ import os
 import sys
 import time
 
+from threading import Thread
 from timeit import default_timer
 
 from proxytools import utils
+from proxytools.ip2location import IP2LocationDatabase
+from proxytools.known_proxies import KnownProxies
+from proxytools.proxy_store import ProxyStore
 from proxytools.proxy_tester import ProxyTester
 from proxytools.proxy_parser import MixedParser, HTTPParser, SOCKSParser
-from proxytools.models import init_database, Proxy, ProxyProtocol
+from proxytools.scrappers import SCRAPPERS
+from proxytools.models import init_database, Proxy, ProxyProtocol, ProxyTest
 
 log = logging.getLogger()
 
@@ -76,6 +81,10 @@ def check_configuration(args):
         log.error('You must supply a proxylist file or enable scrapping.')
         sys.exit(1)
 
+    if args.proxy_file_watch < 0:
+        log.error('Proxy file watch interval must be zero or greater.')
+        sys.exit(1)
+
     if args.proxy_protocol == 'all':
         args.proxy_protocol = None
     elif args.proxy_protocol == 'http':
@@ -87,10 +96,52 @@ def check_configuration(args):
         log.error('You must specify a URL for an AZenv proxy judge.')
         sys.exit(1)
 
+    if args.ip2location_refresh_days < 0:
+        log.error('IP2Location refresh days must be zero or greater.')
+        sys.exit(1)
+
+    if args.scrapper_max_concurrency <= 0:
+        log.error('Scrapper max concurrency must be greater than zero.')
+        sys.exit(1)
+
+    if args.scrapper_cache_days <= 0:
+        log.error('Scrapper cache days must be greater than zero.')
+        sys.exit(1)
+
+    if args.scrapper_cache_size <= 0:
+        log.error('Scrapper cache size must be greater than zero.')
+        sys.exit(1)
+
+    for name in args.scrapper_enable + args.scrapper_disable:
+        if name not in SCRAPPERS:
+            log.error('Unknown proxy scrapper: %s. Available scrappers: %s.',
+                      name, ', '.join(SCRAPPERS))
+            sys.exit(1)
+
+    if args.db_insert_batch <= 0:
+        log.error('Database insert batch size must be greater than zero.')
+        sys.exit(1)
+
+    if args.db_purge_chunk <= 0:
+        log.error('Database purge chunk size must be greater than zero.')
+        sys.exit(1)
+
+    if args.db_history_days < 0:
+        log.error('Database history days must be zero or greater.')
+        sys.exit(1)
+
+    if args.db_flush_interval <= 0:
+        log.error('Database flush interval must be greater than zero.')
+        sys.exit(1)
+
     if args.tester_max_concurrency <= 0:
         log.error('Proxy tester max concurrency must be greater than zero.')
         sys.exit(1)
 
+    if args.tester_lease_time <= 0:
+        log.error('Proxy tester lease time must be greater than zero.')
+        sys.exit(1)
+
     args.local_ip = None
     if not args.tester_disable_anonymity:
         local_ip = utils.get_local_ip(args.proxy_judge)
@@ -153,25 +204,24 @@ def work(tester, parsers):
         sys.exit(1)
 
     # Fetch and insert new proxies from configured sources.
-    for proxy_parser in parsers:
-        proxy_parser.load_proxylist()
-
-    # Remove failed proxies from database.
-    Proxy.clean_failed()
+    refresher = refresh_proxylists(parsers, True)
 
     refresh_timer = default_timer()
     output_timer = default_timer()
     errors = 0
     while True:
         now = default_timer()
-        if now > refresh_timer + args.proxy_refresh_interval:
-            refresh_timer = now
+        clean = now > refresh_timer + args.proxy_refresh_interval
+        if refresher.is_alive():
+            if clean:
+                log.warning('Previous proxylist refresh is still running.')
+        elif clean or any(parser.is_due() for parser in parsers):
+            # Each source is refreshed on its own adaptive schedule.
             log.info('Refreshing proxylists configured from sources.')
-            for proxy_parser in parsers:
-                proxy_parser.load_proxylist()
+            refresher = refresh_proxylists(parsers, clean)
 
-            # Remove failed proxies from database.
-            Proxy.clean_failed()
+        if clean:
+            refresh_timer = now
 
             # Validate proxy tester benchmark responses.
             if not tester.validate_responses():
@@ -187,6 +237,66 @@ def work(tester, parsers):
         time.sleep(60)
 
 
+def refresh_proxylists(parsers, clean):
+    refresher = Thread(name='proxy-refresher', target=refresh_worker,
+                       args=(parsers, clean))
+    refresher.daemon = True
+    refresher.start()
+    return refresher
+
+
+# Load proxylists from all parsers concurrently in the background,
+# removing failed proxies from database once they finish if `clean` is set.
+def refresh_worker(parsers, clean):
+    threads = []
+    for proxy_parser in parsers:
+        t = Thread(name=type(proxy_parser).__name__.lower(),
+                   target=load_proxylist, args=(proxy_parser,))
+        t.daemon = True
+        t.start()
+        threads.append(t)
+
+    for t in threads:
+        t.join()
+
+    if not clean:
+        return
+
+    try:
+        clean_failed()
+    except Exception as e:
+        log.exception('Failed to remove failed proxies: %s', e)
+
+
+def load_proxylist(proxy_parser):
+    try:
+        proxy_parser.load_proxylist()
+    except Exception as e:
+        log.exception('%s failed to load proxylist: %s',
+                      type(proxy_parser).__name__, e)
+
+
+def clean_failed():
+    ignore_countries = list(ip2location.ignore_codes)
+    if proxy_store is not None:
+        # Save pending test results before removing failed proxies.
+        proxy_store.flush()
+        proxy_store.purge_failed(args.proxy_expire_days, ignore_countries)
+
+    deleted = []
+    Proxy.clean_failed(args.db_purge_chunk, args.db_purge_pause,
+                       args.db_purge_time, args.proxy_expire_days, deleted,
+                       ignore_countries)
+    known_proxies.discard(deleted)
+
+    if args.db_history_days:
+        ProxyTest.prune(args.db_history_days)
+
+
+def get_valid(limit, anonymous, protocol):
+    return proxy_tester.valid_pool.get(limit, anonymous, protocol)
+
+
 def output(args):
     log.info('Outputting working proxylist.')
 
@@ -194,48 +304,43 @@ def output(args):
     working_socks = []
 
     if args.output_kinancity:
-        working_http = Proxy.get_valid(
+        working_http = get_valid(
             args.output_limit,
             args.tester_disable_anonymity,
-            args.proxy_scan_interval,
             ProxyProtocol.HTTP)
 
         export_kinancity(args.output_kinancity, working_http)
 
     if args.output_proxychains:
-        proxylist = Proxy.get_valid(
+        proxylist = get_valid(
             args.output_limit,
             args.tester_disable_anonymity,
-            args.proxy_scan_interval,
             args.proxy_protocol)
 
         export_proxychains(args.output_proxychains, proxylist)
 
     if args.output_rocketmap:
-        working_socks = Proxy.get_valid(
+        working_socks = get_valid(
             args.output_limit,
             args.tester_disable_anonymity,
-            args.proxy_scan_interval,
             ProxyProtocol.SOCKS5)
 
         export(args.output_rocketmap, working_socks)
 
     if args.output_http:
         if not working_http:
-            working_http = Proxy.get_valid(
+            working_http = get_valid(
                 args.output_limit,
                 args.tester_disable_anonymity,
-                args.proxy_scan_interval,
                 ProxyProtocol.HTTP)
 
         export(args.output_http, working_http, args.output_no_protocol)
 
     if args.output_socks:
         if not working_socks:
-            working_socks = Proxy.get_valid(
+            working_socks = get_valid(
                 args.output_limit,
                 args.tester_disable_anonymity,
-                args.proxy_scan_interval,
                 ProxyProtocol.SOCKS5)
 
         export(args.output_socks, working_socks, args.output_no_protocol)
@@ -291,17 +396,32 @@ if __name__ == '__main__':
     configure_logging(args, log)
     check_configuration(args)
     init_database(
-        args.db_name, args.db_host, args.db_port, args.db_user, args.db_pass)
+        args.db_name, args.db_host, args.db_port, args.db_user, args.db_pass,
+        local_infile=args.db_load_data_threshold > 0,
+        download_path=args.download_path)
 
-    proxy_tester = ProxyTester(args)
-    proxy_parsers = [MixedParser(args)]
+    proxy_store = None
+    if args.db_memory_store:
+        proxy_store = ProxyStore(args)
+        proxy_store.load()
+        proxy_store.launch()
+
+    known_proxies = KnownProxies()
+    known_proxies.load()
+
+    ip2location = IP2LocationDatabase(args)
+    proxy_tester = ProxyTester(args, ip2location, proxy_store)
+    proxy_parsers = [
+        MixedParser(args, ip2location, proxy_store, known_proxies)]
 
     protocol = args.proxy_protocol
     if protocol is None or protocol == ProxyProtocol.HTTP:
-        proxy_parsers.append(HTTPParser(args))
+        proxy_parsers.append(
+            HTTPParser(args, ip2location, proxy_store, known_proxies))
 
     if protocol is None or protocol == ProxyProtocol.SOCKS5:
-        proxy_parsers.append(SOCKSParser(args))
+        proxy_parsers.append(
+            SOCKSParser(args, ip2location, proxy_store, known_proxies))
 
     try:
         work(proxy_tester, proxy_parsers)
@@ -312,4 +432,8 @@ if __name__ == '__main__':
         proxy_tester.running.set()
         log.info('Waiting for proxy tester to shutdown...')
 
+        if proxy_store is not None:
+            proxy_store.running.set()
+            proxy_store.flush()
+
     sys.exit(0)